@@ -1,19 +1,339 @@
 import sys
 import os
+import io
+import re
 import argparse
 import json
 import numbers
+import collections
+import collections.abc
+import concurrent.futures
+import hashlib
+import threading
+import sqlite3
+import socket
+import time
+import contextlib
+import pickle
+import urllib.request
+import operend_session
 from opyrnd import ApiBacked, EntityClass, Entity, WorkFile
 from opyrnd.jobs import JobRun;
 
 
+class JSONEventReader:
+    """Pulls a JSON document from a file object a piece at a time, so that
+    callers can walk the parts of it they care about and skip over the rest
+    without ever holding the whole document tree in memory.
+
+    The caller drives the walk: iter_object() and iter_array() are
+    generators that position the reader at each member in turn, and the
+    caller must consume each member with exactly one of read_value(),
+    skip_value(), iter_object() or iter_array() before asking for the next.
+    Only values handed back by read_value() are ever decoded into Python
+    objects; skip_value() just scans past the text."""
+    chunk_size=1<<20
+    _whitespace=re.compile(r'[ \t\n\r]*')
+    _skip_run=re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*',re.S)
+    _string_special=re.compile(r'["\\]')
+    _number_run=re.compile(r'[0-9+\-.eE]*')
+
+    def __init__(self,fileobj):
+        if isinstance(fileobj.read(0),bytes):
+            fileobj=io.TextIOWrapper(fileobj,encoding="utf-8")
+        self.fileobj=fileobj
+        self.buf=""
+        self.pos=0
+        self.eof=False
+        self.decoder=json.JSONDecoder()
+
+    def _fill(self,at_least=None):
+        # Drops the consumed prefix of the buffer and appends more text.
+        # Returns False once the file is exhausted.
+        if self.eof:
+            return False
+        if self.pos:
+            self.buf=self.buf[self.pos:]
+            self.pos=0
+        chunk=self.fileobj.read(max(self.chunk_size,at_least or 0))
+        if not chunk:
+            self.eof=True
+            return False
+        self.buf+=chunk
+        return True
+
+    def _peek(self):
+        while True:
+            m=self._whitespace.match(self.buf,self.pos)
+            self.pos=m.end()
+            if self.pos<len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise Exception("Unexpected end of JSON input")
+
+    def _expect(self,char):
+        if self._peek()!=char:
+            raise Exception(f"Expected '{char}' in JSON input, saw '{self.buf[self.pos]}'")
+        self.pos+=1
+
+    def read_value(self):
+        self._peek()
+        while True:
+            try:
+                value,end=self.decoder.raw_decode(self.buf,self.pos)
+            except json.JSONDecodeError:
+                # Probably just a value that runs past the end of the
+                # buffer; read more (growing geometrically so that a big
+                # value isn't re-decoded once per chunk) and try again.
+                if not self._fill(len(self.buf)):
+                    raise
+                continue
+            if (isinstance(value,(int,float)) and not isinstance(value,bool)
+                    and self._number_run.match(self.buf,self.pos).end()==len(self.buf)
+                    and self._fill(len(self.buf))):
+                # A number running up to the buffer end may go on in the
+                # next chunk: 1 decoded from "1." whose 5 is yet to come,
+                # or 1 from "1e" before "-3". Decode it again with more.
+                continue
+            self.pos=end
+            return value
+
+    def skip_value(self):
+        char=self._peek()
+        if char=='"':
+            self._skip_string()
+            return
+        if char not in "[{":
+            self.read_value()
+            return
+        # A container that is all in the buffer is quickest to skip by
+        # letting the C decoder parse it and dropping the result; one that
+        # runs past the end of the buffer is scanned instead, so a huge
+        # value never has to fit in memory.
+        try:
+            _,self.pos=self.decoder.raw_decode(self.buf,self.pos)
+            return
+        except json.JSONDecodeError:
+            pass
+        depth=0
+        while True:
+            # Strings and scalars between brackets are passed over inside
+            # the regex engine, so this loops once per bracket, not once
+            # per token.
+            self.pos=self._skip_run.match(self.buf,self.pos).end()
+            if self.pos>=len(self.buf) or self.buf[self.pos]=='"':
+                # Out of text, or a string that ends in the next chunk.
+                if not self._fill(len(self.buf)-self.pos):
+                    raise Exception("Unexpected end of JSON input")
+                continue
+            char=self.buf[self.pos]
+            self.pos+=1
+            if char in "[{":
+                depth+=1
+            else:
+                depth-=1
+                if depth==0:
+                    return
+
+    def _skip_string(self):
+        self.pos+=1
+        while True:
+            m=self._string_special.search(self.buf,self.pos)
+            if not m or m.start()+1>=len(self.buf):
+                # Either no closing quote yet, or a backslash whose escaped
+                # character is still in the next chunk.
+                if m and m.group()=='"':
+                    self.pos=m.end()
+                    return
+                self.pos=m.start() if m else len(self.buf)
+                if not self._fill():
+                    raise Exception("Unexpected end of JSON input")
+                continue
+            if m.group()=='"':
+                self.pos=m.end()
+                return
+            self.pos=m.start()+2
+
+    def iter_object(self):
+        self._expect("{")
+        first=True
+        while True:
+            char=self._peek()
+            if char=="}":
+                self.pos+=1
+                return
+            if not first:
+                self._expect(",")
+            first=False
+            key=self.read_value()
+            self._expect(":")
+            yield key
+
+    def iter_array(self):
+        self._expect("[")
+        first=True
+        while True:
+            char=self._peek()
+            if char=="]":
+                self.pos+=1
+                return
+            if not first:
+                self._expect(",")
+            first=False
+            yield
+
+
+class _Missing:
+    """Type of MISSING, which marks a ColumnTable cell that has no value
+    (as opposed to a value of None). Pickles back to the same object."""
+    def __repr__(self):
+        return "MISSING"
+    def __reduce__(self):
+        return "MISSING"
+
+MISSING=_Missing()
+
+
+class ColumnTable(collections.abc.Mapping):
+    """Read-only mapping from row number to a RowView, which maps column
+    name to value like the per-row dicts it replaces, but stored column by
+    column: each column name is held once, with a list of values indexed
+    by row position, padded with MISSING where a row has no value. With
+    tens of thousands of rows sharing the same few dozen keys, that is a
+    small fraction of the size of a dict per row.
+
+    Writes go through add_row(), set() and append(), not the views."""
+    def __init__(self):
+        self.positions={}
+        self.columns={}
+
+    def add_row(self, row):
+        if row not in self.positions:
+            self.positions[row]=len(self.positions)
+        return self.positions[row]
+
+    def get_value(self, row, key, default=None):
+        column=self.columns.get(key)
+        position=self.positions.get(row)
+        if column is None or position is None or position>=len(column):
+            return default
+        value=column[position]
+        return default if value is MISSING else value
+
+    def set(self, row, key, value):
+        position=self.add_row(row)
+        column=self.columns.get(key)
+        if column is None:
+            column=self.columns[key]=[]
+        if position>=len(column):
+            column.extend([MISSING]*(position+1-len(column)))
+        column[position]=value
+
+    def append(self, row, key, value):
+        # Appends to the list value of key in row, starting a new list if
+        # there isn't one yet.
+        values=self.get_value(row,key,MISSING)
+        if values is MISSING:
+            values=[]
+            self.set(row,key,values)
+        values.append(value)
+
+    def __getstate__(self):
+        # MISSING is a singleton that pickle could only find again by module
+        # name, which differs between running this as a script and
+        # importing it; so the state lists where it goes instead.
+        columns={}
+        for key,column in self.columns.items():
+            missing=[i for i,v in enumerate(column) if v is MISSING]
+            if missing:
+                column=[None if v is MISSING else v for v in column]
+            columns[key]=(column,missing)
+        return self.positions,columns
+
+    def __setstate__(self, state):
+        self.positions,columns=state
+        self.columns={}
+        for key,(column,missing) in columns.items():
+            for i in missing:
+                column[i]=MISSING
+            self.columns[key]=column
+
+    def column_values(self, key, rows):
+        """The values of column key for rows, in that order, with MISSING
+        where a row has none."""
+        column=self.columns.get(key,())
+        length=len(column)
+        positions=self.positions
+        values=[]
+        for row in rows:
+            position=positions.get(row,length)
+            values.append(column[position] if position<length else MISSING)
+        return values
+
+    def __getitem__(self, row):
+        if row not in self.positions:
+            raise KeyError(row)
+        return RowView(self,self.positions[row])
+
+    def __contains__(self, row):
+        return row in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class RowView(collections.abc.Mapping):
+    """One row of a ColumnTable, as a read-only mapping of the columns
+    that have a value in that row."""
+    __slots__=("table","position")
+
+    def __init__(self, table, position):
+        self.table=table
+        self.position=position
+
+    def __getitem__(self, key):
+        column=self.table.columns.get(key)
+        if (column is None or self.position>=len(column) or
+            column[self.position] is MISSING):
+            raise KeyError(key)
+        return column[self.position]
+
+    def __contains__(self, key):
+        column=self.table.columns.get(key)
+        return (column is not None and self.position<len(column) and
+                column[self.position] is not MISSING)
+
+    def get(self, key, default=None):
+        column=self.table.columns.get(key)
+        if (column is None or self.position>=len(column) or
+            column[self.position] is MISSING):
+            return default
+        return column[self.position]
+
+    def __iter__(self):
+        position=self.position
+        for key,column in self.table.columns.items():
+            if position<len(column) and column[position] is not MISSING:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class CromwellIO:
     """Takes Cromwell metadata (as gathered via a json.load() of 
     Cromwell's -m output file) and accumulates .input_rows and .output_rows,
-    dicts of key-value dicts. The outer keys are integers relating to 
-    Cromwell shard numbering, and the inner keys are dot-separated names
-    relating to Cromwell fields. The values are whatever types they were
-    in the JSON parse. 
+    ColumnTables that read like dicts of key-value dicts. The outer keys
+    are integers relating to Cromwell shard numbering, and the inner keys
+    are dot-separated names relating to Cromwell fields. The values are
+    whatever types they were in the JSON parse. The metadata itself is
+    dropped once the rows are gathered.
 
     input_rows_and output_rows have the same outer keys, and.row_numbers is
     those keys sorted in numerically ascending order.
@@ -21,39 +341,175 @@ class CromwellIO:
     This assumes the important part of the Cromwell run is performing a
     scatter, so that each shard of that scatter corresponds to a row. If there
     are multiple scatters, they need to be non-nested and to be ordered so 
-    that corresponding rows refer to the same entity."""
-    def __init__(self,run_metadata):
+    that corresponding rows refer to the same entity.
+
+    Subworkflows may be nested to any depth. Going down from the top of the
+    metadata, the first sharded call on the way defines the row. Under it,
+    a further sharded call (a scatter inside the per-row subworkflow) is
+    handled by the nested_shards rule for that call's key:
+      "array" (the default): the outputs of all those inner shards, and of
+        anything under them, are collected into lists on the row, and their
+        inputs are ignored.
+      "rows": each inner shard is a row of its own, keyed by the tuple of
+        shard indexes on the way down, e.g. (3, 0), (3, 1); each such row
+        also gets the values recorded for the rows above it, which are
+        then not rows themselves. Once any row is keyed by a tuple, all of
+        them are.
+    nested_shards is either one of those rules for every call, or a dict
+    from call key to rule, with "*" for the rest.
+
+    Names: a top-level call's values are named <call>.<field>, with the
+    workflow name dropped from Cromwell's <workflow>.<call> call key. At
+    every level inside a subworkflow, the call key is used as it is, so
+    values are named <subworkflow>.<call>.<field>, where <subworkflow> is
+    the innermost subworkflow's own workflow name (not the chain of calls
+    that led to it). If two places in the tree give one row two
+    different values under the same name, that is reported as an
+    ambiguity.
+
+    For metadata files too big to json.load(), use CromwellIO.from_stream()
+    instead of the constructor; it builds the same rows while reading the
+    file incrementally."""
+    def __init__(self,run_metadata,nested_shards="array"):
         self.run_metadata=run_metadata
-        self.input_rows={}
-        self.output_rows={}
+        self.input_rows=ColumnTable()
+        self.output_rows=ColumnTable()
+        self.column_names={}
+        self.nested_shards=nested_shards
+        self.clean=True;
+        with metrics.phase("gather_data"):
+            self.gather_data();
+            self.run_metadata=None
+            self.finish_rows();
+
+    @classmethod
+    def from_stream(cls,fileobj,nested_shards="array"):
+        """Builds a CromwellIO from an open Cromwell metadata file without
+        loading the whole document. Only the calls -> shards -> 
+        shardIndex/inputs/outputs/subWorkflowMetadata parts of the file are
+        decoded; everything else (submittedFiles, executionEvents, and so
+        on, which are most of the bytes) is scanned past. Each top-level
+        shard is pared down to just those parts and handed to the same
+        per-shard logic the constructor uses, so the rows, and the clean
+        ambiguity detection, come out the same."""
+        self=cls.__new__(cls)
+        self.run_metadata=None
+        self.input_rows=ColumnTable()
+        self.output_rows=ColumnTable()
+        self.column_names={}
+        self.nested_shards=nested_shards
         self.clean=True;
-        self.gather_data();
+        reader=JSONEventReader(fileobj)
+        for key in reader.iter_object():
+            if key!="calls":
+                reader.skip_value()
+                continue
+            for k in reader.iter_object():
+                for _ in reader.iter_array():
+                    self.gather_call_shard(k,cls.read_stream_shard(reader))
+        self.finish_rows();
+        return self
+
+    @staticmethod
+    def read_stream_shard(reader):
+        # Cromwell writes subWorkflowMetadata before shardIndex, so a shard
+        # can't be processed until its object is closed; this keeps just
+        # the parts gather_call_shard looks at until then. Nested
+        # subworkflows are followed with an explicit stack of the objects
+        # and arrays being read rather than by recursion.
+        shard={}
+        stack=[("shard",shard,reader.iter_object())]
+        while stack:
+            kind,target,members=stack[-1]
+            try:
+                key=next(members)
+            except StopIteration:
+                stack.pop()
+                continue
+            if kind=="shard":
+                if key in ("shardIndex","inputs","outputs"):
+                    target[key]=reader.read_value()
+                elif key=="subWorkflowMetadata":
+                    calls={}
+                    target[key]={"calls":calls}
+                    stack.append(("metadata",calls,reader.iter_object()))
+                else:
+                    reader.skip_value()
+            elif kind=="metadata":
+                if key=="calls":
+                    stack.append(("calls",target,reader.iter_object()))
+                else:
+                    reader.skip_value()
+            elif kind=="calls":
+                target[key]=[]
+                stack.append(("shards",target[key],reader.iter_array()))
+            else:
+                target.append({})
+                stack.append(("shard",target[-1],reader.iter_object()))
+        return shard
+
+    def to_state(self):
+        # Plain data for ParsedMetadataCache; see from_state().
+        return {"input_rows":self.input_rows.__getstate__(),
+                "output_rows":self.output_rows.__getstate__(),
+                "row_numbers":self.row_numbers,
+                "nested_shards":self.nested_shards}
+
+    @classmethod
+    def from_state(cls,state):
+        self=cls.__new__(cls)
+        self.run_metadata=None
+        self.input_rows=ColumnTable.__new__(ColumnTable)
+        self.input_rows.__setstate__(state["input_rows"])
+        self.output_rows=ColumnTable.__new__(ColumnTable)
+        self.output_rows.__setstate__(state["output_rows"])
+        self.row_numbers=state["row_numbers"]
+        self.nested_shards=state["nested_shards"]
+        self.column_names=None
+        self.clean=True
+        return self
+
+    def nested_rule(self,call_key):
+        if isinstance(self.nested_shards,str):
+            return self.nested_shards
+        return self.nested_shards.get(call_key,
+                                      self.nested_shards.get("*","array"))
+
+    def finish_rows(self):
+        if any(isinstance(key,tuple) for key in
+               list(self.input_rows)+list(self.output_rows)):
+            self.inherit_parent_rows()
         for k in self.input_rows.keys():
-            if k not in self.output_rows:
-                self.output_rows[k]={}
+            self.output_rows.add_row(k)
         for k in self.output_rows.keys():
-            if k not in self.input_rows:
-                self.input_rows[k]={}
+            self.input_rows.add_row(k)
         self.row_numbers=sorted(self.input_rows.keys());
+        self.column_names=None
         if not self.clean:
             raise Exception("Parser reached an ambiguity reading Cromwell metadata. (This is probably a bug in the parser.)");
+    def column_name(self,call_name,key):
+        # Every shard of a call has the same keys, so build each dotted
+        # name once and share the string between all the rows.
+        name=self.column_names.get((call_name,key))
+        if name is None:
+            name=self.column_names[(call_name,key)]=sys.intern(
+                f"{call_name}.{key}")
+        return name
     def record_input(self,row,key,value):
-        if row not in self.input_rows:
-           self.input_rows[row]={}
-        if key in self.input_rows[row] and value!=self.input_rows[row][key]:
+        old_value=self.input_rows.get_value(row,key,MISSING)
+        if old_value is not MISSING and value!=old_value:
             # if this happens, the row number logic is probably wrong;
             # we reach this point if we are looking in two different places
             # in the metadata and think we have the same input name and
             # the same shard number.
             print(f"confused by duplicate input key {key} for row {row}",file=sys.stderr);
-            print(f"saw values {self.input_rows[row][key]} and {value}")
+            print(f"saw values {old_value} and {value}")
             self.clean=False;
         else:
-            self.input_rows[row][key]=value;
+            self.input_rows.set(row,key,value);
     def record_output(self,row,key,value):
-        if row not in self.output_rows:
-           self.output_rows[row]={}
-        if key in self.output_rows[row] and value!=self.output_rows[row][key]:
+        old_value=self.output_rows.get_value(row,key,MISSING)
+        if old_value is not MISSING and value!=old_value:
             # if this happens, the row number logic is probably wrong;
             # we reach this point if we are looking in two different places
             # in the metadata and think we have the same output name and
@@ -61,80 +517,82 @@ class CromwellIO:
             print(f"confused by duplicate output key {key} for row {row}",file=sys.stderr);
             self.clean=False;
         else:
-            self.output_rows[row][key]=value;
+            self.output_rows.set(row,key,value);
     def append_array_output(self,row,key,value):
-        if row not in self.output_rows:
-            self.output_rows[row]={}
-        if key not in self.output_rows[row]:
-            self.output_rows[row][key]=[]
-        self.output_rows[row][key].append(value);            
+        self.output_rows.append(row,key,value);
     def gather_data(self):
         for k in self.run_metadata["calls"]:
-            shards=self.run_metadata["calls"][k];
-            if "." in k:
-                call_name= ".".join(k.split(".")[1:]);
-            else:
-                call_name=k;
-            for i in range(len(shards)):
-                shard_index=shards[i]["shardIndex"]
-                if shard_index>-1:
-                    if "inputs" in shards[i]:
-                        for ki in shards[i]["inputs"]:                   
-                            self.record_input(shard_index,f"{call_name}.{ki}",
-                                              shards[i]["inputs"][ki]);
-                    if "outputs" in shards[i]:
-                        for ki in shards[i]["outputs"]:
-                            self.record_output(shard_index,f"{call_name}.{ki}",
-                                               shards[i]["outputs"][ki]);
-                if "subWorkflowMetadata" in shards[i]:
-                    self.gather_subcall_data(call_name,
-                                             shard_index,
-                                             shards[i]["subWorkflowMetadata"])
-
-    def gather_subcall_data(self,parent_name, parent_row, sub_meta):
-        for k in sub_meta["calls"]:
-            shards=sub_meta["calls"][k];
-            for i in range(len(shards)):
-                shard_index=shards[i]["shardIndex"]
-                if parent_row==-1: 
-                    row=shard_index
+            for shard in self.run_metadata["calls"][k]:
+                self.gather_call_shard(k,shard)
+
+    def gather_call_shard(self,k,shard):
+        if "." in k:
+            call_name= ".".join(k.split(".")[1:]);
+        else:
+            call_name=k;
+        # Walks the shard and everything under it depth-first, in document
+        # order, with an explicit stack so nesting depth doesn't matter.
+        # Each entry is (name prefix, call key, shard, shard path, whether
+        # values go into arrays). The shard path is the shard indexes that
+        # make up the row key, and is empty until the first sharded call.
+        stack=[(call_name,k,shard,(),False)]
+        while stack:
+            name,call_key,shard,path,in_array=stack.pop()
+            shard_index=shard["shardIndex"]
+            if shard_index>-1 and not in_array:
+                if not path:
+                    path=(shard_index,)
+                elif self.nested_rule(call_key)=="rows":
+                    path=path+(shard_index,)
                 else:
-                    if shard_index>-1:
-                        # Special case: non-array file outputs that are an
-                        # extra subshard deep can be fetched by treating them
-                        # as an array of files.
-                        if "outputs" in shards[i]:
-                            for ki in shards[i]["outputs"]:
-                                self.append_array_output(
-                                    parent_row,
-                                    f"{k}.{ki}",
-                                    shards[i]["outputs"][ki]);
-                        row=None
-                    else:
-                        row=parent_row
-                if row!=None and row>-1:
-                    if "inputs" in shards[i]:
-                        for ki in shards[i]["inputs"]:                   
-                            self.record_input(row,f"{k}.{ki}",
-                                              shards[i]["inputs"][ki]);
-                    if "outputs" in shards[i]:
-                        for ki in shards[i]["outputs"]:
-                            self.record_output(row,f"{k}.{ki}",
-                                               shards[i]["outputs"][ki]);
-                if row!=None and "subWorkflowMetadata" in shards[i]:
-                    # if this happens, a case I didn't code for has arisen.
-                    # It will be a quick fix to support if it ever happens;
-                    # we just need to call gather_subcall_data recursively!
-                    # We're not doing that now because I'm not sure how
-                    # the dotted naming of nested subworkflows works, so
-                    # I don't know how much to trim off parent_name in the
-                    # subcall to get the right concatenated name. Just one
-                    # example of Cromwell metadata that triggers this line
-                    # should be enough to know what the convention is.
-                    print("Confused by nesting depth, {k} is a sharded subworkflow with internal subworkflows.");
-                    self.clean=False;
-
-                            
+                    in_array=True
+            row=path[0] if len(path)==1 else path
+            if in_array:
+                # non-array file outputs that are an extra subshard deep
+                # can be fetched by treating them as an array of files.
+                if "outputs" in shard:
+                    for ki in shard["outputs"]:
+                        self.append_array_output(row,self.column_name(name,ki),
+                                                 shard["outputs"][ki]);
+            elif path:
+                if "inputs" in shard:
+                    for ki in shard["inputs"]:                   
+                        self.record_input(row,self.column_name(name,ki),
+                                          shard["inputs"][ki]);
+                if "outputs" in shard:
+                    for ki in shard["outputs"]:
+                        self.record_output(row,self.column_name(name,ki),
+                                           shard["outputs"][ki]);
+            if "subWorkflowMetadata" in shard:
+                children=[(sub_key,sub_shard)
+                          for sub_key,sub_shards in
+                          shard["subWorkflowMetadata"]["calls"].items()
+                          for sub_shard in sub_shards]
+                for sub_key,sub_shard in reversed(children):
+                    stack.append((sub_key,sub_key,sub_shard,path,in_array))
+
+    def inherit_parent_rows(self):
+        # For the "rows" rule: makes each row at the bottom of the shard
+        # tree a row of its own, with the values of the rows above it.
+        paths={key if isinstance(key,tuple) else (key,)
+               for key in list(self.input_rows)+list(self.output_rows)}
+        parents={path[:n] for path in paths for n in range(1,len(path))}
+        input_rows=ColumnTable()
+        output_rows=ColumnTable()
+        for path in sorted(paths-parents):
+            for old,new in ((self.input_rows,input_rows),
+                            (self.output_rows,output_rows)):
+                new.add_row(path)
+                for n in range(len(path),0,-1):
+                    key=path[0] if n==1 else path[:n]
+                    if key not in old:
+                        continue
+                    for column,value in old[key].items():
+                        if new.get_value(path,column,MISSING) is MISSING:
+                            new.set(path,column,value)
+        self.input_rows=input_rows
+        self.output_rows=output_rows
+
     def print_matches(self,io_spec):        
         row_indices=set(self.input_rows.keys());
         row_indices.update(self.output_rows.keys());
@@ -172,20 +630,288 @@ class CromwellIO:
         keys.sort();
         print(keys)                
 
-def list_metadata(metadata_filename):
-    table=CromwellIO(json.load(open(metadata_filename)));
-    input_examples={}
-    output_examples={}
-    for row in table.input_rows.values():
-        for k in row:
-            v=row[k]
-            if k not in input_examples or (v!=None and input_examples[k]==None):
-                input_examples[k]=v;
-    for row in table.output_rows.values():
-        for k in row:
-            v=row[k]
-            if k not in output_examples or (v!=None and output_examples[k]==None):
-                output_examples[k]=v;
+def file_digest(fname, block_size=1<<20):
+    h=hashlib.blake2b(digest_size=20)
+    with open(fname,"rb") as f:
+        for block in iter(lambda: f.read(block_size),b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ParsedMetadataCache:
+    """On-disk cache of the CromwellIO tables parsed from metadata files,
+    so that --very-dry-run, --dry-run and the real run of one multi-GB
+    file only parse it once. An entry is found by the file's absolute
+    path, size and mtime (and the nested_shards rule, which changes the
+    rows), and only used if the file's content hash still matches the one
+    it was made from: hashing is a small fraction of the cost of parsing.
+
+    Entries are pickles of the tables' plain state (see
+    ColumnTable.__getstate__), so only point this at a directory nobody
+    else can write to. The least recently used entries are removed once
+    the directory holds more than max_bytes."""
+    version=1
+
+    def __init__(self, directory=None, max_bytes=2<<30):
+        self.directory=directory or os.path.join(
+            os.path.expanduser("~"),".cache","cromwell2operend","parsed")
+        self.max_bytes=max_bytes
+
+    def entry_filename(self, metadata_filename, nested_shards):
+        stat=os.stat(metadata_filename)
+        identity=json.dumps([os.path.abspath(metadata_filename),stat.st_size,
+                             stat.st_mtime_ns,nested_shards,self.version],
+                            sort_keys=True)
+        return os.path.join(self.directory,
+                            hashlib.sha1(identity.encode()).hexdigest()+".pickle")
+
+    def load(self, metadata_filename, nested_shards="array"):
+        """Returns (CromwellIO or None, content hash), the hash being for
+        store() on a miss."""
+        entry=self.entry_filename(metadata_filename, nested_shards)
+        digest=file_digest(metadata_filename)
+        if not os.path.exists(entry):
+            return None, digest
+        try:
+            with open(entry,"rb") as f:
+                cached=pickle.load(f)
+        except Exception as e:
+            print(f"ignoring unreadable parse cache entry {entry}: {e}",file=sys.stderr)
+            return None, digest
+        if cached.get("digest")!=digest:
+            return None, digest
+        os.utime(entry)
+        return CromwellIO.from_state(cached["state"]), digest
+
+    def store(self, metadata_filename, nested_shards, table, digest):
+        os.makedirs(self.directory,exist_ok=True)
+        entry=self.entry_filename(metadata_filename, nested_shards)
+        temporary=f"{entry}.{os.getpid()}.tmp"
+        with open(temporary,"wb") as f:
+            pickle.dump({"digest":digest,"state":table.to_state()},f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary,entry)
+        self.evict()
+
+    def evict(self):
+        entries=[]
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".pickle"):
+                stat=item.stat()
+                entries.append((stat.st_mtime,stat.st_size,item.path))
+        total=sum(size for _,size,_ in entries)
+        for _,size,path in sorted(entries):
+            if total<=self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total-=size
+
+parse_cache=None
+
+def load_cromwell_io(metadata_filename, stream=False, nested_shards="array"):
+    if parse_cache:
+        with metrics.phase("parse_cache_load"):
+            table,digest=parse_cache.load(metadata_filename, nested_shards)
+        if table:
+            return table
+        table=parse_metadata(metadata_filename, stream, nested_shards)
+        with metrics.phase("parse_cache_store"):
+            parse_cache.store(metadata_filename, nested_shards, table, digest)
+        return table
+    return parse_metadata(metadata_filename, stream, nested_shards)
+
+def parse_metadata(metadata_filename, stream=False, nested_shards="array"):
+    if stream:
+        with open(metadata_filename,"rb") as f:
+            return metrics.call("parse_stream",
+                                CromwellIO.from_stream, f, nested_shards);
+    with open(metadata_filename) as f:
+        return CromwellIO(metrics.call("load_json", json.load, f),
+                          nested_shards);
+
+def json_type(value):
+    if value is None:
+        return "null"
+    if isinstance(value,bool):
+        return "boolean"
+    if isinstance(value,numbers.Integral):
+        return "integer"
+    if isinstance(value,numbers.Real):
+        return "number"
+    if isinstance(value,str):
+        return "string"
+    if isinstance(value,list):
+        return "array"
+    return "object"
+
+class MetadataSample(CromwellIO):
+    """What --list reports about a metadata file: for every input and
+    output name, an example value (a non-None one if any shard read has
+    one), the JSON types seen, and whether the values are arrays. The
+    names are the same as a CromwellIO's, but no rows are kept, and each
+    call's shards can be sampled instead of read in full:
+      max_shards: read at most this many shards of each call.
+      early_stop: stop reading a call's shards once one adds nothing new
+        (no new name, and no name's first non-None example) and every name
+        has a non-None example; or, since some inputs are None in every
+        shard, once patience shards in a row have added nothing new.
+    Sampling can miss names that only later shards have; shards_read and
+    shards_seen say how much was read."""
+    patience=10
+
+    def __init__(self,max_shards=None,early_stop=False,nested_shards="array"):
+        self.run_metadata=None
+        self.column_names={}
+        self.nested_shards=nested_shards
+        self.clean=True;
+        self.max_shards=max_shards
+        self.early_stop=early_stop
+        self.inputs={}
+        self.outputs={}
+        self.array_rows={}
+        self.changed=False
+        self.shards_read={}
+        self.shards_seen={}
+
+    @classmethod
+    def from_file(cls,metadata_filename,stream=False,max_shards=None,
+                  early_stop=False,nested_shards="array"):
+        self=cls(max_shards,early_stop,nested_shards)
+        if not stream:
+            with open(metadata_filename) as f:
+                calls=metrics.call("load_json", json.load, f)["calls"]
+            for k in calls:
+                sampling=self.start_call(k)
+                for shard in calls[k]:
+                    self.shards_seen[k]+=1
+                    if next(sampling):
+                        self.gather_call_shard(k,shard)
+            return self
+        with open(metadata_filename,"rb") as f:
+            reader=JSONEventReader(f)
+            for key in reader.iter_object():
+                if key!="calls":
+                    reader.skip_value()
+                    continue
+                for k in reader.iter_object():
+                    sampling=self.start_call(k)
+                    for _ in reader.iter_array():
+                        self.shards_seen[k]+=1
+                        if next(sampling):
+                            self.gather_call_shard(k,cls.read_stream_shard(reader))
+                        else:
+                            reader.skip_value()
+                # Nothing after the calls matters here, so don't read it.
+                break
+        return self
+
+    def start_call(self,k):
+        # A generator saying, before each of call k's shards, whether to
+        # read it.
+        self.shards_read[k]=0
+        self.shards_seen[k]=0
+        def sampling():
+            idle=0
+            while self.max_shards is None or self.shards_read[k]<self.max_shards:
+                self.changed=False
+                self.call_names=set()
+                self.shards_read[k]+=1
+                yield True
+                idle=0 if self.changed else idle+1
+                if self.early_stop and idle and (
+                        idle>=self.patience or
+                        all(self.example_found(name) for name in self.call_names)):
+                    break
+            while True:
+                yield False
+        return sampling()
+
+    def example_found(self,name):
+        summary=self.inputs.get(name) or self.outputs.get(name)
+        return summary["example"] is not None
+
+    def observe(self,summaries,key,value,in_array=False):
+        self.call_names.add(key)
+        summary=summaries.get(key)
+        if summary is None:
+            summary=summaries[key]={"example":None,"types":set(),
+                                    "item_types":set(),"array":False,
+                                    "values_seen":0}
+            self.changed=True
+        summary["values_seen"]+=1
+        if in_array:
+            summary["array"]=True
+            summary["item_types"].add(json_type(value))
+            # The example of an array built from inner shards is the
+            # first row's array.
+            first_row=self.array_rows.setdefault(key,self.row)
+            if first_row==self.row:
+                if summary["example"] is None:
+                    summary["example"]=[]
+                    self.changed=True
+                summary["example"].append(value)
+            return
+        summary["types"].add(json_type(value))
+        if isinstance(value,list):
+            summary["array"]=True
+            summary["item_types"].update(json_type(item) for item in value)
+        if summary["example"] is None and value is not None:
+            summary["example"]=value
+            self.changed=True
+
+    def record_input(self,row,key,value):
+        self.observe(self.inputs,key,value)
+    def record_output(self,row,key,value):
+        self.observe(self.outputs,key,value)
+    def append_array_output(self,row,key,value):
+        self.row=row
+        self.observe(self.outputs,key,value,in_array=True)
+
+    @staticmethod
+    def looks_like_file(summary):
+        values=summary["example"] if summary["array"] else [summary["example"]]
+        if not isinstance(values,list) or summary["item_types"]-{"string","null"}:
+            return False
+        values=[v for v in values if v is not None]
+        return bool(values) and all(
+            isinstance(v,str) and (v.startswith("/") or "://" in v)
+            for v in values)
+
+    def to_json(self):
+        def describe(summaries,outputs):
+            described={}
+            for name in sorted(summaries):
+                summary=summaries[name]
+                types=summary["types"]|({"array"} if summary["array"] else set())
+                described[name]={
+                    "example":summary["example"],
+                    "types":sorted(types),
+                    "array":summary["array"],
+                    "item_types":sorted(summary["item_types"]),
+                    "nullable":"null" in types or "null" in summary["item_types"],
+                    "values_seen":summary["values_seen"]}
+                if outputs:
+                    described[name]["looks_like_file"]=self.looks_like_file(summary)
+            return described
+        return {"inputs":describe(self.inputs,False),
+                "outputs":describe(self.outputs,True),
+                "calls":{k:{"shards_read":self.shards_read[k],
+                            "shards_seen":self.shards_seen[k]}
+                         for k in self.shards_read},
+                "complete":self.shards_read==self.shards_seen}
+
+def list_metadata(metadata_filename, stream=False, nested_shards="array",
+                  max_shards=None, early_stop=False, as_json=False):
+    sample=MetadataSample.from_file(metadata_filename, stream, max_shards,
+                                    early_stop, nested_shards);
+    if as_json:
+        json.dump(sample.to_json(), sys.stdout, indent=1, default=str);
+        print();
+        return;
+    input_examples={k:v["example"] for k,v in sample.inputs.items()}
+    output_examples={k:v["example"] for k,v in sample.outputs.items()}
     # The point here is to see the data types; seeing the entire string for a
     # filename or long string value shouldn't be important, so this snips out
     # middles to keep the concise. repr() is used instead of str() so that
@@ -202,14 +928,371 @@ def list_metadata(metadata_filename):
         if len(v)>40 :
            v=v[:17]+" [...] "+v[-17:]
         print(f"{k}\t{v}");
+    if sample.shards_read!=sample.shards_seen:
+        print(f"\n(sampled {sum(sample.shards_read.values())} of {sum(sample.shards_seen.values())} shards; names only later shards have are not listed)")
+
+def export_formats():
+    return {".tsv":"tsv", ".txt":"tsv", ".csv":"csv", ".parquet":"parquet",
+            ".pq":"parquet", ".arrow":"arrow", ".feather":"arrow"}
+
+secret_name=re.compile(r"secret|token|password",re.I)
+
+def export_columns(table, columns=None):
+    """The (name, values) columns of table to export, each with a value
+    per row in table.row_numbers order, under a leading "row" column.
+    columns picks input and output names (in that order); by default
+    every input and then every output column, each sorted, except ones
+    whose names look like credentials."""
+    rows=table.row_numbers
+    if columns is None:
+        # Workflows get passed API credentials as inputs; an export is for
+        # sharing, so leave those out unless they're asked for by name.
+        columns=[name for name in (sorted(table.input_rows.columns)+
+                                   sorted(table.output_rows.columns))
+                 if not secret_name.search(name)]
+    exported=[("row",[list(row) if isinstance(row,tuple) else row
+                      for row in rows])]
+    for name in columns:
+        if name in table.input_rows.columns:
+            exported.append((name,table.input_rows.column_values(name,rows)))
+        elif name in table.output_rows.columns:
+            exported.append((name,table.output_rows.column_values(name,rows)))
+        else:
+            raise Exception(f"No input or output named {name} in the metadata; see --list for the names.");
+    return exported
+
+def export_cell(value):
+    # Text for one TSV/CSV cell: strings as they are, nothing for a
+    # missing or null value, and everything else (arrays included) as
+    # JSON, so that it reads back the same way in any language.
+    if isinstance(value,str):
+        return value
+    if value is None or value is MISSING:
+        return ""
+    return json.dumps(value)
+
+def export_table(table, filename, fmt=None, columns=None):
+    """Writes the columns of table (see export_columns) to filename as
+    "tsv", "csv", "parquet" or "arrow" (Arrow IPC/Feather); by default the
+    format goes by the file extension. The text formats are written
+    through the csv module, so values holding tabs, commas or newlines are
+    quoted. Parquet and Arrow need pyarrow, and give each column the type
+    its values have, or JSON text if they have more than one."""
+    if not fmt:
+        fmt=export_formats().get(os.path.splitext(filename)[1].lower())
+        if not fmt:
+            raise Exception(f"Can't tell the export format from {filename}; give --export-format.");
+    exported=export_columns(table, columns)
+    if fmt in ("tsv","csv"):
+        import csv
+        with open(filename,"w",newline="",buffering=1<<20) as f:
+            writer=csv.writer(f,delimiter="\t" if fmt=="tsv" else ",",
+                              lineterminator="\n")
+            writer.writerow([name for name,_ in exported])
+            writer.writerows(zip(*[[v if type(v) is str else export_cell(v)
+                                    for v in values]
+                                   for _,values in exported]))
+        return
+    if fmt not in ("parquet","arrow"):
+        raise Exception(f"Unknown export format {fmt}; use tsv, csv, parquet or arrow.");
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception(f"Exporting {fmt} needs the pyarrow package; pip install pyarrow, or export tsv or csv.");
+    arrays=[]
+    for _,values in exported:
+        values=[None if v is MISSING else v for v in values]
+        try:
+            arrays.append(pyarrow.array(values))
+        except (pyarrow.ArrowInvalid,pyarrow.ArrowTypeError):
+            arrays.append(pyarrow.array(
+                [None if v is None else export_cell(v) for v in values],
+                type=pyarrow.string()))
+    arrow_table=pyarrow.table(arrays,names=[name for name,_ in exported])
+    if fmt=="parquet":
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(arrow_table,filename)
+    else:
+        import pyarrow.feather
+        pyarrow.feather.write_feather(arrow_table,filename)
+
+def config_cache_filename(ini_filename, prefix, suffix):
+    """Filename under ~/.cache/cromwell2operend for something that is only
+    meaningful on the Operend server a config file points at, such as
+    wfids or entity class definitions."""
+    with open(ini_filename,"rb") as f:
+        scope=hashlib.sha1(f.read()).hexdigest()[:12]
+    return os.path.join(os.path.expanduser("~"),".cache","cromwell2operend",
+                        f"{prefix}-{scope}{suffix}")
+
+class CachedVariableDefinition:
+    """The parts of an opyrnd VariableDefinition that IOMapping looks at,
+    as read back from a SchemaCache file."""
+    def __init__(self, name, type, is_array, codes):
+        self.name=name
+        self.type=type
+        self.is_array=is_array
+        self.codes=codes
+
+class CachedEntityClass:
+    def __init__(self, class_name, variables):
+        self.class_name=class_name
+        self.variables=variables
+
+class SchemaCache:
+    """Entity class lookups for IOMapping.validate. Each class is fetched
+    from the server at most once per process. If a filename and a nonzero
+    ttl (seconds) are given, definitions are also kept on disk and reused
+    by later invocations until they are ttl seconds old, which saves a
+    schema fetch per run when ingesting many Cromwell runs against the same
+    entity class.
+
+    A definition read from disk can be out of date even within its ttl,
+    so IOMapping.validate refetches it before reporting a mismatch."""
+    def __init__(self, filename=None, ttl=0):
+        self.filename=filename if ttl>0 else None
+        self.ttl=ttl
+        self.memo={}
+        self.from_disk=set()
+
+    def entity_class(self, name, refresh=False):
+        if name in self.memo and not refresh:
+            return self.memo[name]
+        ec=None if refresh else self.load(name)
+        if ec:
+            self.from_disk.add(name)
+        else:
+            ec=EntityClass.get_by_name(name)
+            self.from_disk.discard(name)
+            if ec:
+                self.save(name,ec)
+        self.memo[name]=ec
+        return ec
+
+    def load(self, name):
+        if not self.filename or not os.path.exists(self.filename):
+            return None
+        with open(self.filename) as f:
+            entry=json.load(f).get(name)
+        if not entry or time.time()-entry["fetched"]>self.ttl:
+            return None
+        return CachedEntityClass(name, {
+            k:CachedVariableDefinition(k,v["type"],v["is_array"],v["codes"])
+            for k,v in entry["variables"].items()})
+
+    def save(self, name, ec):
+        if not self.filename:
+            return
+        entry={"fetched":time.time(),"variables":{
+            k:{"type":vd.type,"is_array":bool(vd.is_array),
+               "codes":getattr(vd,"codes",None)}
+            for k,vd in ec.variables.items()}}
+        try:
+            json.dumps(entry)
+        except TypeError:
+            # codes of a type we don't know how to write back; just don't
+            # cache this class on disk.
+            return
+        entries={}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                entries=json.load(f)
+        entries[name]=entry
+        os.makedirs(os.path.dirname(self.filename) or ".",exist_ok=True)
+        # write-then-rename, so concurrent runs never read a partial file
+        temp_filename=f"{self.filename}.{os.getpid()}.tmp"
+        with open(temp_filename,"w") as f:
+            json.dump(entries,f)
+        os.replace(temp_filename,self.filename)
+
+schema_cache=SchemaCache()
+
+class RunMetrics:
+    """Where the time of a run went, for --metrics-out and
+    --metrics-textfile: wall time per phase, latency and size of every
+    file upload, entities saved per second of saving, and counters such as
+    retries. The rest of the script reports to the module-level metrics
+    object; main() replaces the default, disabled one when either option is
+    given. Disabled, phase() hands back one shared do-nothing context
+    manager and the other methods return at once, so the calls can stay in
+    the hot paths.
+
+    Phases are accumulated by name, so a phase entered more than once (as in
+    --batch) reports its total. "uploads" is the time the row loop spent
+    waiting on uploads, which with --upload-workers is less than the sum of
+    the per-file latencies. In --batch, loading and dry validation happen
+    in worker processes and aren't included."""
+    quantiles=(0.5,0.95,0.99)
+
+    def __init__(self, enabled=False):
+        self.enabled=enabled
+        self.lock=threading.Lock()
+        self.started=time.time()
+        self.phases={}
+        self.counters={"retries":0, "entities_saved":0}
+        self.uploads=[]
+        self.error=None
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.timed(name)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name,time.perf_counter()-start)
+
+    def call(self, name, function, *args):
+        # Like "with phase(name): return function(*args)", for results that
+        # shouldn't be kept alive in a local variable of the caller.
+        if not self.enabled:
+            return function(*args)
+        with self.timed(name):
+            return function(*args)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.phases[name]=self.phases.get(name,0.0)+seconds
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name]=self.counters.get(name,0)+n
+
+    def record_upload(self, fname, seconds, size, reused):
+        with self.lock:
+            self.uploads.append({"file":fname, "seconds":seconds,
+                                 "bytes":size, "reused":reused})
+
+    def report(self):
+        uploaded=[u for u in self.uploads if not u["reused"]]
+        latencies=sorted(u["seconds"] for u in uploaded)
+        upload_seconds=sum(latencies)
+        uploaded_bytes=sum(u["bytes"] for u in uploaded)
+        saved=self.counters["entities_saved"]
+        save_seconds=self.phases.get("entity_saves",0.0)
+        return {
+            "started": self.started,
+            "status": "failed" if self.error else "ok",
+            "error": self.error,
+            "phases": dict(self.phases),
+            "uploads": {
+                "files": len(uploaded),
+                "reused": len(self.uploads)-len(uploaded),
+                "bytes": uploaded_bytes,
+                "seconds": upload_seconds,
+                "bytes_per_second": (uploaded_bytes/upload_seconds
+                                     if upload_seconds else None),
+                "latency": {f"p{int(q*100)}":
+                            latencies[min(len(latencies)-1,int(q*len(latencies)))]
+                            for q in self.quantiles} if latencies else {},
+                "per_file": self.uploads,
+            },
+            "entities": {
+                "saved": saved,
+                "seconds": save_seconds,
+                "per_second": saved/save_seconds if save_seconds else None,
+            },
+            "retries": self.counters["retries"],
+            "counters": dict(self.counters),
+        }
+
+    def write(self, json_filename=None, textfile_filename=None):
+        report=self.report()
+        if json_filename:
+            with open(json_filename,"w") as f:
+                json.dump(report,f,indent=1)
+        if textfile_filename:
+            self.write_textfile(report,textfile_filename)
+
+    @staticmethod
+    def write_textfile(report, filename):
+        # Prometheus node_exporter textfile-collector format. The collector
+        # may read the directory at any moment, so write a temporary file
+        # next to it and rename it into place.
+        lines=[]
+        def gauge(name, help_text, samples):
+            lines.append(f"# HELP cromwell2operend_{name} {help_text}")
+            lines.append(f"# TYPE cromwell2operend_{name} gauge")
+            for labels,value in samples:
+                lines.append(f"cromwell2operend_{name}{labels} {value}")
+        gauge("phase_seconds","Wall time spent in each phase of the last run.",
+              [(f'{{phase="{name}"}}',seconds)
+               for name,seconds in sorted(report["phases"].items())])
+        uploads=report["uploads"]
+        gauge("upload_files","Files uploaded, or matched to an earlier upload, in the last run.",
+              [('{result="uploaded"}',uploads["files"]),
+               ('{result="reused"}',uploads["reused"])])
+        gauge("upload_bytes","Bytes uploaded in the last run.",
+              [("",uploads["bytes"])])
+        gauge("upload_seconds","Sum of per-file upload latencies in the last run.",
+              [("",uploads["seconds"])])
+        gauge("upload_latency_seconds","Per-file upload latency quantiles in the last run.",
+              [(f'{{quantile="{int(name[1:])/100}"}}',value)
+               for name,value in uploads["latency"].items()])
+        gauge("entities_saved","Entities saved in the last run.",
+              [("",report["entities"]["saved"])])
+        gauge("entities_per_second","Entities saved per second of saving in the last run.",
+              [("",report["entities"]["per_second"] or 0)])
+        gauge("retries","Requests retried in the last run.",
+              [("",report["retries"])])
+        gauge("last_run_success","1 if the last run finished without error.",
+              [("",0 if report["error"] else 1)])
+        gauge("last_run_timestamp_seconds","When the last run started.",
+              [("",report["started"])])
+        directory=os.path.dirname(os.path.abspath(filename))
+        temporary=os.path.join(directory,f".{os.path.basename(filename)}.{os.getpid()}")
+        with open(temporary,"w") as f:
+            f.write("\n".join(lines)+"\n")
+        os.replace(temporary,filename)
+
+metrics=RunMetrics()
+
+def format_bytes(n):
+    for unit in ("bytes","KiB","MiB","GiB","TiB"):
+        if n<1024 or unit=="TiB":
+            break
+        n=n/1024
+    return f"{n} {unit}" if unit=="bytes" else f"{n:.1f} {unit}"
+
+class ValidationReport:
+    """Everything IOMapping found wrong in one pass over a CromwellIO,
+    so that all of it can be fixed before the next try. schema_violations
+    counts the ones that came from comparing with the entity class."""
+    shown=50
+
+    def __init__(self):
+        self.violations=[]
+        self.schema_violations=0
+
+    def add(self, message, schema=False):
+        self.violations.append(message)
+        if schema:
+            self.schema_violations+=1
+
+    def raise_if_any(self):
+        if not self.violations:
+            return
+        lines=self.violations[:self.shown]
+        if len(self.violations)>self.shown:
+            lines.append(f"... and {len(self.violations)-self.shown} more.")
+        raise Exception(f"Validation found {len(self.violations)} problems:\n"+
+                        "\n".join(lines));
 
 class IOMapping:
     """Takes the data describing a mapping from Cromwell to Operend 
     (as gathered via a json.load() from a suitable JSON file) for
     application to a CromwellIO object.
     """;
-    def __init__(self,manifest_data, mock_filename=None):
+    def __init__(self,manifest_data, mock_filename=None, preflight_workers=16):
         self.mock_filename=mock_filename;
+        self.preflight_workers=preflight_workers;
+        self.file_sizes={}
         def grab(key, validator, validTypeName):
             if key not in manifest_data:
                 raise Exception(f"key '{key}' not in manifest");
@@ -254,86 +1337,183 @@ class IOMapping:
                     "Manifest contains keys other than entityClass, inputValues, outputValues, and outputFiles."
                 );
     def dry_validate(self, cromwell_io):
+        with metrics.phase("validate"):
+            self.check_rows(cromwell_io).raise_if_any();
+        self.print_upload_summary();
+    def validate(self, cromwell_io, check_files=True):
+        with metrics.phase("validate"):
+            ec=schema_cache.entity_class(self.entity_class);
+            if not ec:
+                raise Exception(f"Operend server has no visible entity class named {self.entity_class}");
+            report=self.check_rows(cromwell_io, ec, check_files);
+            if report.schema_violations and self.entity_class in schema_cache.from_disk:
+                # The cached definition may be out of date; only the server's
+                # current one can really fail validation.
+                ec=schema_cache.entity_class(self.entity_class, refresh=True);
+                if not ec:
+                    raise Exception(f"Operend server has no visible entity class named {self.entity_class}");
+                report=self.check_rows(cromwell_io, ec, check_files);
+            report.raise_if_any();
+            if check_files:
+                self.print_upload_summary();
+    def check_rows(self, cromwell_io, ec=None, check_files=True):
+        """Checks every row of cromwell_io against the manifest, and against
+        entity class ec if given, and returns a ValidationReport of
+        everything wrong. check_files=False skips looking for the output
+        files, for when dry_validate has already done that. The manifest
+        is first compiled into a list of check functions per Cromwell key,
+        so the rows are gone through only once however many manifest keys
+        there are."""
+        report=ValidationReport()
+        input_checks=collections.defaultdict(list)
+        output_checks=collections.defaultdict(list)
+        files=[]
         for k in self.input_values:
-            if not any( (k in row) for row in cromwell_io.input_rows.values()):
-                print (cromwell_io.input_rows[0].keys())
-                raise Exception(f"Manifest specifies input {k}, which is not found in the Cromwell metadata.");
-        for k in self.output_values:
-            if not any( (k in row) for row in cromwell_io.output_rows.values()):
-                raise Exception(f"Manifest specifies output {k}, which is not found in the Cromwell metadata.");
-        for k in self.output_values:
-            for row in cromwell_io.output_rows.values():
-                if k in row and row[k]!=None:
-                    if not self.is_legal_entity_value(k):
-                        raise Exception(f"Saw for output {k} a value of unsupported type: {row[k]}");            
-        for k in self.output_files:
-            if not any( (k in row) for row in cromwell_io.output_rows.values()):
-                raise Exception(f"Manifest specifies output {k}, which is not found in the Cromwell metadata.");
-        for k in self.output_files:
-            for row in cromwell_io.output_rows.values():
-                if k in row and row[k]!=None:
-                    fname=row[k];
-                    # Check that the file exists, and that permissions
-                    # allow opening it for reading.
-                    if isinstance(fname, list):
-                        for eachfile in fname:
-                            self.open_file(eachfile,k).close();
-                    else:
-                        # pass k just for info in case of exception
-                        self.open_file(fname,k).close();
-    def validate(self, cromwell_io):
-        # Local checks first...
-        self.dry_validate(cromwell_io);
-        # Now, does it match the entity class?
-        ec=EntityClass.get_by_name(self.entity_class);
-        if not ec:
-            raise Exception(f"Operend server has no visible entity class named {self.entity_class}");
-        # check that every input value matches the entity class definition
-        for k in self.input_values:
-            if self.input_values[k] not in ec.variables:
-                raise Exception(f"Entity class does not have a variable named {self.input_values[k]}");
-            vd=ec.variables[self.input_values[k]];
-            if vd.type=="W":
-                raise Exception("Entity class definition for field {self.input_values[k] expects a file, but mapping is for a non-file value");
-            for row in cromwell_io.input_rows.values():
-                if k in row and not self.validate_value_for_definition(row[k],vd):
-                    raise Exception(f"Entity class definition for field {self.input_values[k]} wants type {vd.type} and does not match Cromwell value {row[k]}");
-        # check that every output value matches the entity class definition
+            if k not in cromwell_io.input_rows.columns:
+                report.add(f"Manifest specifies input {k}, which is not found in the Cromwell metadata.");
+        for k in list(self.output_values)+list(self.output_files):
+            if k not in cromwell_io.output_rows.columns:
+                report.add(f"Manifest specifies output {k}, which is not found in the Cromwell metadata.");
         for k in self.output_values:
-            if self.output_values[k] not in ec.variables:
-                raise Exception(f"Entity class does not have a variable named {self.output_values[k]}");
-            vd=ec.variables[self.output_values[k]];
-            if vd.type=="W":
-                raise Exception(f"Entity class definition for field {self.output_values[k]} expects a file, but mapping is for a non-file value");
-            row_loop_number=0
-            for row in cromwell_io.output_rows.values():
-                if k in row and not self.validate_value_for_definition(row[k],vd):
-                    raise Exception(f"Entity class definition for field {self.output_values[k]} wants type {vd.type} and does not match Cromwell value {row[k]}");
-                if k not in row:
-                    raise Exception(f"Entity class definition for field {self.output_values[k]} wants a value but shard {row_loop_number} had none.");                  
-                row_loop_number=row_loop_number+1                
-
-        # check that every output file matches the entity class definition.
-        # dry_validate already checked for files locally, so we just
-        # check that the definition is file-type and  of matching array-ness.
+            def check_legal(row, value, k=k):
+                if (value is not MISSING and value!=None and
+                    not self.is_legal_entity_value(value)):
+                    report.add(f"Saw for output {k} a value of unsupported type: {value}");
+            output_checks[k].append(check_legal)
         for k in self.output_files:
-            if self.output_files[k] not in ec.variables:
-                raise Exception(f"Entity class does not have a variable named {self.output_files[k]}");            
-            vd=ec.variables[self.output_files[k]];
-            if vd.type!="W":
-                raise Exception(f"Entity class definition for field {self.output_files[k]} does not accept a file, but mapping is for an output file");
-            row_loop_number=0
-            for row in cromwell_io.output_rows.values():
-                if k in row:
-                    if vd.is_array:
-                        if not isinstance(row[k],list):                    
-                            raise Exception(f"Entity class definition for field {self.output_files[k]} expects an array, but encountered a non-array file.");
+            def collect_files(row, value, k=k):
+                if value is MISSING or value==None:
+                    return
+                for fname in (value if isinstance(value,list) else [value]):
+                    if isinstance(fname,str):
+                        files.append((fname,k))
                     else:
-                        if isinstance(row[k], list):
-                            raise Exception(f"Entity class definition for field {self.output_files[k]} expects a single file, but encountered an array.");
-                else:
-                    raise Exception(f"Entity class definition for field {self.output_files[k]} expects file output, but shard {row_loop_number} had none.");
-                row_loop_number=row_loop_number+1                
+                        report.add(f"Expected a string filename, saw non-string value {fname} for field {k}");
+            output_checks[k].append(collect_files)
+        if ec:
+            for k,field in self.input_values.items():
+                vd=self.non_file_variable(ec, field, report)
+                if vd:
+                    input_checks[k].append(self.compile_value_check(
+                        field, vd, report, required=False))
+            for k,field in self.output_values.items():
+                vd=self.non_file_variable(ec, field, report)
+                if vd:
+                    output_checks[k].append(self.compile_value_check(
+                        field, vd, report, required=True))
+            for k,field in self.output_files.items():
+                if field not in ec.variables:
+                    report.add(f"Entity class does not have a variable named {field}", schema=True);
+                    continue
+                vd=ec.variables[field];
+                if vd.type!="W":
+                    report.add(f"Entity class definition for field {field} does not accept a file, but mapping is for an output file", schema=True);
+                    continue
+                output_checks[k].append(self.compile_file_check(
+                    field, vd, report))
+        input_checks=list(input_checks.items())
+        output_checks=list(output_checks.items())
+        for row_number in cromwell_io.row_numbers:
+            row=cromwell_io.input_rows[row_number]
+            for k,checks in input_checks:
+                value=row.get(k,MISSING)
+                for check in checks:
+                    check(row_number,value)
+            row=cromwell_io.output_rows[row_number]
+            for k,checks in output_checks:
+                value=row.get(k,MISSING)
+                for check in checks:
+                    check(row_number,value)
+        # Check that the files exist, and that permissions allow opening
+        # them for reading.
+        if check_files:
+            self.file_sizes=self.preflight_files(files, report)
+        return report
+    def preflight_files(self, files, report):
+        """Checks that every (fname, key) in files is a readable regular
+        file, adding a violation to report for each one that isn't, and
+        returns a dict of file sizes. Cromwell puts each call's outputs in
+        a directory of their own, so the files are grouped by directory and
+        each directory is listed just once, on a pool of
+        preflight_workers threads; on a network filesystem the
+        latency of all those lookups is most of the cost."""
+        if self.mock_filename:
+            try:
+                size=os.stat(self.mock_filename).st_size
+            except OSError as e:
+                report.add(f"Cannot read mock file: {e}");
+                return {}
+            return {fname:size for fname,k in files}
+        by_directory=collections.defaultdict(list)
+        for fname,k in files:
+            by_directory[os.path.dirname(fname)].append((fname,k))
+        def check_directory(directory, dir_files):
+            sizes={}
+            problems=[]
+            try:
+                with os.scandir(directory or ".") as it:
+                    entries={entry.name:entry for entry in it}
+            except OSError as e:
+                return sizes,[f"Cannot read output file for {k}: {fname}: {e}"
+                              for fname,k in dir_files]
+            for fname,k in dir_files:
+                entry=entries.get(os.path.basename(fname))
+                try:
+                    if entry is None:
+                        raise FileNotFoundError(f"No such file: '{fname}'")
+                    if not entry.is_file():
+                        raise OSError(f"Not a regular file: '{fname}'")
+                    if not os.access(fname,os.R_OK):
+                        raise PermissionError(f"Not readable: '{fname}'")
+                    sizes[fname]=entry.stat().st_size
+                except OSError as e:
+                    problems.append(f"Cannot read output file for {k}: {e}")
+            return sizes,problems
+        sizes={}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.preflight_workers) as executor:
+            for dir_sizes,problems in executor.map(
+                    lambda item: check_directory(*item), by_directory.items()):
+                sizes.update(dir_sizes)
+                for problem in problems:
+                    report.add(problem)
+        return sizes
+    def print_upload_summary(self):
+        total=sum(self.file_sizes.values())
+        print(f"{len(self.file_sizes)} output files to upload, {format_bytes(total)} in total");
+    @staticmethod
+    def non_file_variable(ec, field, report):
+        if field not in ec.variables:
+            report.add(f"Entity class does not have a variable named {field}", schema=True);
+            return None
+        vd=ec.variables[field];
+        if vd.type=="W":
+            report.add(f"Entity class definition for field {field} expects a file, but mapping is for a non-file value", schema=True);
+            return None
+        return vd
+    @staticmethod
+    def compile_value_check(field, vd, report, required):
+        validator=IOMapping.compile_value_validator(vd)
+        def check(row, value):
+            if value is MISSING:
+                if required:
+                    report.add(f"Entity class definition for field {field} wants a value but shard {row} had none.", schema=True);
+            elif not validator(value):
+                report.add(f"Entity class definition for field {field} wants type {vd.type} and does not match Cromwell value {value} in shard {row}", schema=True);
+        return check
+    @staticmethod
+    def compile_file_check(field, vd, report):
+        # dry checks already look for the files locally, so this just
+        # checks that there is one in every row, of matching array-ness.
+        is_array=vd.is_array
+        def check(row, value):
+            if value is MISSING:
+                report.add(f"Entity class definition for field {field} expects file output, but shard {row} had none.", schema=True);
+            elif is_array and not isinstance(value,list):
+                report.add(f"Entity class definition for field {field} expects an array, but encountered a non-array file in shard {row}.", schema=True);
+            elif not is_array and isinstance(value,list):
+                report.add(f"Entity class definition for field {field} expects a single file, but encountered an array in shard {row}.", schema=True);
+        return check
     @staticmethod
     def is_legal_entity_value(value):
         # Is this value valid for _some_ supported entity variable type?
@@ -357,82 +1537,532 @@ class IOMapping:
             
     @staticmethod
     def validate_value_for_definition(value,definition):
-        def validate_item(item):
-            if definition.type=="T":
-                return isinstance(item,str);
-            if definition.type=="F":
-                return isinstance(item,numbers.Real);
-            if definition.type=="I":
-                return isinstance(item,numbers.Integral);
-            if definition.type=="C":
-                for c in definition.codes:
-                    if value in c.keys():
-                        return True
-                return False
-            if definition.type=="W":
-                raise Exception("Hit unreachable case in validate_value_for_definition");
+        return IOMapping.compile_value_validator(definition)(value);
+
+    @staticmethod
+    def compile_value_validator(definition):
+        # Dispatches on the definition once and returns a function that
+        # checks one value, so checking a whole column doesn't redo it.
+        if definition.type=="T":
+            validate_item=lambda item: isinstance(item,str);
+        elif definition.type=="F":
+            validate_item=lambda item: isinstance(item,numbers.Real);
+        elif definition.type=="I":
+            validate_item=lambda item: isinstance(item,numbers.Integral);
+        elif definition.type=="C":
+            codes=set()
+            for c in definition.codes:
+                codes.update(c.keys())
+            def validate_item(item):
+                try:
+                    return item in codes
+                except TypeError: # unhashable, so not a code
+                    return False
+        elif definition.type=="W":
+            raise Exception("Hit unreachable case in validate_value_for_definition");
+        else:
             # If we need more fields, we can deal them in when they come up!
             print(f"Support for entity variable type {definition.type} is unimplemented.");
+            validate_item=lambda item: False;
         if definition.is_array:
-            if isinstance(value,list):
-                for item in value:
-                    if not validate_item(item):
-                        return false;
-                return True;
-            else:
-                return False;
+            return lambda value: (isinstance(value,list) and
+                                  all(validate_item(item) for item in value));
         else:
-            if isinstance(value,list):
-                return False;
-            return validate_item(value);
-            
+            return lambda value: (not isinstance(value,list) and
+                                  validate_item(value));
 
-            
-    def open_file(self,fname,field_name):
-        if not isinstance(fname,str):
-            raise Exception(f"Expected a string filename, saw non-string value {fname} for field {field_name}");            
-        return open(self.mock_filename or fname);
-            
 def very_dry_run(metadata_filename, manifest_filename,
-                 job_run_id, mock_filename=None):
-    table= CromwellIO(json.load(open(metadata_filename)));
-    manifest=IOMapping(json.load(open(manifest_filename)), mock_filename);
+                 job_run_id, mock_filename=None, stream=False, dedup=None,
+                 preflight_workers=16, nested_shards="array", partition=None):
+    table= load_cromwell_io(metadata_filename, stream, nested_shards);
+    if partition:
+        select_partition(table, *partition);
+    manifest=IOMapping(json.load(open(manifest_filename)), mock_filename,
+                       preflight_workers);
     manifest.dry_validate(table);
     dry_run_posts(table, manifest,
-                  job_run_id);
+                  job_run_id, dedup);
 
 def dry_run(metadata_filename, manifest_filename,
-                 job_run_id, mock_filename=None):
-    table= CromwellIO(json.load(open(metadata_filename)));
-    manifest=IOMapping(json.load(open(manifest_filename)), mock_filename);
+                 job_run_id, mock_filename=None, stream=False, dedup=None,
+                 preflight_workers=16, nested_shards="array", partition=None):
+    table= load_cromwell_io(metadata_filename, stream, nested_shards);
+    if partition:
+        select_partition(table, *partition);
+    manifest=IOMapping(json.load(open(manifest_filename)), mock_filename,
+                       preflight_workers);
     manifest.validate(table);
     if job_run_id!=None:
         confirm_job_run_exists(job_run_id);
     dry_run_posts(table, manifest,
-                  job_run_id);
+                  job_run_id, dedup);
 
 def full_run(metadata_filename, manifest_filename,
-                 job_run_id, mock_filename=None):
-    table= CromwellIO(json.load(open(metadata_filename)));
-    manifest=IOMapping(json.load(open(manifest_filename)), mock_filename);
+                 job_run_id, mock_filename=None, stream=False,
+                 upload_workers=1, journal_filename=None, resume=False,
+                 dedup=None, entity_batch_size=1, preflight_workers=16,
+                 nested_shards="array", partition=None, partition_dir=None):
+    # With partition=(i, N), only the rows select_partition gives the i-th
+    # of N workers are posted, and instead of updating the JobRun, their
+    # wfids are left in a PartitionOutputs file for finalize_partitions.
+    table= load_cromwell_io(metadata_filename, stream, nested_shards);
+    if partition:
+        select_partition(table, *partition);
+    manifest=IOMapping(json.load(open(manifest_filename)), mock_filename,
+                       preflight_workers);
     manifest.validate(table);
+    job_run=None
     if job_run_id!=None:
-        confirm_job_run_exists(job_run_id);
-    execute_posts(table, manifest,
-                  job_run_id);
+        job_run=confirm_job_run_exists(job_run_id);
+    journal=PostJournal(
+        journal_filename or PostJournal.default_filename(metadata_filename,
+                                                         manifest_filename,
+                                                         partition),
+        metadata_filename, manifest_filename, resume);
+    outputs=None
+    if partition:
+        outputs=PartitionOutputs(metadata_filename, manifest_filename,
+                                 *partition, partition_dir)
+        job_run_id=job_run=None
+    try:
+        execute_posts(table, manifest,
+                      job_run_id, upload_workers, journal, dedup,
+                      entity_batch_size, job_run, outputs);
+        if outputs:
+            outputs.finish();
+        journal.complete();
+    finally:
+        journal.close();
+
+def parse_partition(text):
+    """Parses --partition's "i/N" into (i, N), 1 <= i <= N."""
+    match=re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*",text)
+    if not match or not 1<=int(match.group(1))<=int(match.group(2)):
+        raise ValueError(f"expected i/N with 1 <= i <= N, not {text}")
+    return int(match.group(1)),int(match.group(2))
+
+def partition_of(row, count):
+    # Rows go round-robin by shard number: balanced, the same whichever
+    # node works it out, and, for rows keyed by tuples (see CromwellIO
+    # nested_shards), keeping every row of one outer shard together.
+    outer=row[0] if isinstance(row,tuple) else row
+    return outer%count+1
+
+def select_partition(table, index, count):
+    """Narrows table to the rows of partition index (from 1) of count,
+    for --partition: every row belongs to exactly one partition, so count
+    workers each given a different index post every row once between
+    them. Validation and posting go by table.row_numbers, so they then
+    see only these rows."""
+    table.row_numbers=[row for row in table.row_numbers
+                       if partition_of(row,count)==index]
+    print(f"partition {index} of {count}: {len(table.row_numbers)} rows");
+
+class PartitionOutputs:
+    """The wfids a --partition worker posted, row by row, kept for
+    finalize_partitions to merge into the JobRun once every partition
+    is done, since partitions saving the JobRun themselves would
+    overwrite one another's outputs. execute_posts hands it each row's
+    {field name: [wfids]} through add(), as it would a JobRunUpdater,
+    and finish() writes the file; it is only written once the whole
+    partition has posted, so its being there means the partition is
+    done. A resumed run gets the wfids of rows posted earlier from its
+    journal, so the file comes out the same."""
+    def __init__(self, metadata_filename, manifest_filename, index, count,
+                 directory=None):
+        self.filename=self.default_filename(metadata_filename,
+                                            manifest_filename, index, count,
+                                            directory)
+        if not os.access(os.path.dirname(os.path.abspath(self.filename)),os.W_OK):
+            raise Exception(f"Can't write the wfids of this partition to {self.filename}; pass --partition-dir, the same for every worker and for --finalize-partitions.");
+        self.key=self.partition_key(metadata_filename, manifest_filename,
+                                    count)
+        self.index=index
+        self.rows=[]
+
+    @staticmethod
+    def default_filename(metadata_filename, manifest_filename, index, count,
+                         directory=None):
+        journal=PostJournal.default_filename(metadata_filename,
+                                             manifest_filename,
+                                             (index,count))
+        filename=journal[:-len(".journal")]+".wfids.json"
+        if directory:
+            filename=os.path.join(directory,os.path.basename(filename))
+        return filename
+
+    @staticmethod
+    def partition_key(metadata_filename, manifest_filename, count):
+        return {"metadata":os.path.abspath(metadata_filename),
+                "manifest":PostJournal.manifest_digest(manifest_filename),
+                "partitions":count}
+
+    def add(self, row_wfids, row=None):
+        self.rows.append([row,row_wfids])
+
+    def finish(self):
+        temp_filename=f"{self.filename}.{os.getpid()}.tmp"
+        with open(temp_filename,"w") as f:
+            json.dump(dict(self.key,partition=self.index,rows=self.rows),f)
+        os.replace(temp_filename,self.filename)
+        print(f"wrote the wfids of partition {self.index} of {self.key['partitions']} to {self.filename}");
+
+def finalize_partitions(metadata_filename, manifest_filename, job_run_id,
+                        count, directory=None):
+    """Merges the wfids every --partition worker left behind into the
+    JobRun, in row order, the way a single run would have, and marks it
+    COMPLETE. Refuses to if any partition hasn't finished."""
+    key=PartitionOutputs.partition_key(metadata_filename, manifest_filename,
+                                       count)
+    rows=[]
+    missing=[]
+    for index in range(1,count+1):
+        filename=PartitionOutputs.default_filename(
+            metadata_filename, manifest_filename, index, count, directory)
+        if not os.path.exists(filename):
+            missing.append(index)
+            continue
+        with open(filename) as f:
+            data=json.load(f)
+        if {k:data.get(k) for k in key}!=key or data.get("partition")!=index:
+            raise Exception(f"{filename} was written for a different metadata file, manifest or partitioning.");
+        for row,row_wfids in data["rows"]:
+            rows.append((tuple(row) if isinstance(row,list) else row,row_wfids))
+    if missing:
+        raise Exception(f"Partitions {missing} of {count} haven't finished (no wfid file for them); run or resume those before finalizing.");
+    rows.sort(key=lambda item: item[0] if isinstance(item[0],tuple) else (item[0],))
+    job_run=confirm_job_run_exists(job_run_id);
+    updater=JobRunUpdater(job_run_id, job_run, len(rows))
+    for row,row_wfids in rows:
+        updater.add(row_wfids, row)
+    updater.finish();
     
+def row_defining_shards(metadata):
+    """Maps each row of metadata, numbered as CromwellIO numbers them, to
+    the shards that define it: the latest attempt of each first sharded
+    call on the way down from the top (see CromwellIO). Such a shard is
+    only Done once everything under it is."""
+    rows={}
+    stack=[metadata.get("calls",{})]
+    while stack:
+        calls=stack.pop()
+        for k in calls:
+            latest={}
+            for shard in calls[k]:
+                index=shard.get("shardIndex",-1)
+                if index>-1:
+                    if (index not in latest or
+                        shard.get("attempt",1)>latest[index].get("attempt",1)):
+                        latest[index]=shard
+                elif "subWorkflowMetadata" in shard:
+                    stack.append(shard["subWorkflowMetadata"].get("calls",{}))
+            for index in latest:
+                rows.setdefault(index,[]).append(latest[index])
+    return rows
+
+def metadata_for_rows(metadata, rows):
+    """A copy of metadata with only the shards defining the given rows
+    (the latest attempt of each), for building a CromwellIO of just those
+    rows. The shards themselves are shared, not copied."""
+    pruned_calls={}
+    stack=[(metadata.get("calls",{}),pruned_calls)]
+    while stack:
+        calls,pruned=stack.pop()
+        for k in calls:
+            kept=[]
+            latest={}
+            for shard in calls[k]:
+                index=shard.get("shardIndex",-1)
+                if index>-1:
+                    if index in rows and (
+                            index not in latest or
+                            shard.get("attempt",1)>latest[index].get("attempt",1)):
+                        latest[index]=shard
+                elif "subWorkflowMetadata" in shard:
+                    sub_calls={}
+                    kept.append(dict(shard,subWorkflowMetadata=dict(
+                        shard["subWorkflowMetadata"],calls=sub_calls)))
+                    stack.append((shard["subWorkflowMetadata"].get("calls",{}),
+                                  sub_calls))
+            kept.extend(latest.values())
+            pruned[k]=kept
+    return dict(metadata,calls=pruned_calls)
+
+class MetadataPoller:
+    """Fetches the current metadata of a running workflow for --watch:
+    from a Cromwell server, if source is the URL of a workflow
+    (http://HOST:PORT/api/workflows/v1/WORKFLOW_ID), with subworkflows
+    expanded; otherwise from a metadata file that something keeps
+    rewriting. poll() returns None when there is nothing new: the file
+    hasn't changed or is half-written, or the server couldn't be reached
+    this time."""
+    finished_statuses=("Succeeded","Failed","Aborted")
+
+    def __init__(self, source, timeout=120):
+        self.source=source
+        self.timeout=timeout
+        self.last_stat=None
+
+    def url(self):
+        url=self.source.rstrip("/")
+        if not url.endswith("/metadata"):
+            url+="/metadata"
+        return url+("&" if "?" in url else "?")+"expandSubWorkflows=true"
+
+    def poll(self):
+        if "://" in self.source:
+            try:
+                with urllib.request.urlopen(self.url(),timeout=self.timeout) as response:
+                    return json.load(response)
+            except (OSError,ValueError) as e:
+                print(f"couldn't fetch metadata from {self.url()}, will try again: {e}",file=sys.stderr)
+                return None
+        try:
+            stat=os.stat(self.source)
+            if (stat.st_size,stat.st_mtime_ns)==self.last_stat:
+                return None
+            with open(self.source) as f:
+                metadata=json.load(f)
+        except (FileNotFoundError,ValueError):
+            return None
+        self.last_stat=(stat.st_size,stat.st_mtime_ns)
+        return metadata
+
+def watch_run(source, manifest_filename, job_run_id, mode, parsed_args,
+              dedup=None, nested_shards="array"):
+    """Ingests a workflow while it runs: polls its metadata (see
+    MetadataPoller) every --watch-interval seconds and, each time, posts
+    the rows whose defining shards (see row_defining_shards) have newly
+    reached Done and have every input and output the manifest maps,
+    going through the same CromwellIO rows, IOMapping validation and
+    posting as a whole-file run, in "very_dry", "dry" or "full" mode. The JobRun, if
+    any, gets each row's files as they are posted (see JobRunUpdater),
+    and is marked COMPLETE once the workflow has finished.
+    Rows that never got to Done, or are still missing inputs or outputs
+    when the workflow finishes, are reported and not posted."""
+    poller=MetadataPoller(source)
+    with open(manifest_filename) as f:
+        manifest=IOMapping(json.load(f), parsed_args.mock_file,
+                           parsed_args.preflight_workers);
+    job_run=None
+    if job_run_id!=None and mode!="very_dry":
+        job_run=confirm_job_run_exists(job_run_id);
+    journal=None
+    if mode=="full":
+        journal=PostJournal(
+            parsed_args.journal or PostJournal.default_filename(
+                source, manifest_filename, None,
+                parsed_args.ini or os.getenv('OPYRND_CONFIG')),
+            source, manifest_filename, parsed_args.resume);
+    deadline=(time.time()+parsed_args.watch_timeout
+              if parsed_args.watch_timeout else None)
+    posted=set()
+    incomplete=set()
+    job_run_updater=None
+    if job_run_id!=None and mode=="full":
+        job_run_updater=JobRunUpdater(job_run_id, job_run)
+    defining={}
+    try:
+        while True:
+            metadata=poller.poll()
+            finished=False
+            if metadata is not None:
+                finished=metadata.get("status") in poller.finished_statuses
+                defining=row_defining_shards(metadata)
+                ready={row for row,shards in defining.items()
+                       if row not in posted and row not in incomplete and
+                       all(shard.get("executionStatus")=="Done"
+                           for shard in shards)}
+                if ready:
+                    table=CromwellIO(metadata_for_rows(metadata,ready),
+                                     nested_shards)
+                    # Another scatter may not have got to this row yet;
+                    # wait for it, unless the workflow is over. Any key
+                    # the manifest maps counts, not just output files.
+                    waiting={key[0] if isinstance(key,tuple) else key
+                             for key in table.row_numbers
+                             if any(k not in table.input_rows[key]
+                                    for k in manifest.input_values) or
+                                any(k not in table.output_rows[key]
+                                    for k in list(manifest.output_values)+
+                                    list(manifest.output_files))}
+                    if finished:
+                        incomplete|=waiting
+                    if waiting:
+                        ready-=waiting
+                        table=(CromwellIO(metadata_for_rows(metadata,ready),
+                                          nested_shards) if ready else None)
+                if ready:
+                    print(f"rows {sorted(ready)} are done; posting them")
+                    if mode=="very_dry":
+                        manifest.dry_validate(table);
+                        dry_run_posts(table, manifest, None, dedup);
+                    elif mode=="dry":
+                        manifest.validate(table);
+                        dry_run_posts(table, manifest, None, dedup);
+                    else:
+                        manifest.validate(table);
+                        execute_posts(table, manifest, None,
+                                      parsed_args.upload_workers, journal,
+                                      dedup, parsed_args.entity_batch_size,
+                                      job_run_updater=job_run_updater);
+                    posted|=ready
+            if finished:
+                print(f"workflow {metadata.get('status')}")
+                break
+            if deadline and time.time()>deadline:
+                raise Exception(f"Gave up watching after {parsed_args.watch_timeout} seconds; rows {sorted(posted)} were posted. Rerun with --resume to carry on.");
+            time.sleep(parsed_args.watch_interval)
+    finally:
+        if journal:
+            journal.close();
+    unposted=sorted(set(defining)-posted)
+    if unposted:
+        print(f"rows {unposted} were not posted: they didn't finish, or are missing inputs or outputs the manifest maps",file=sys.stderr)
+    if job_run_id!=None:
+        if mode=="full":
+            job_run_updater.finish();
+        else:
+            print(f"would be updating job run {job_run_id} with the file outputs of rows {sorted(posted)}");
+    if journal:
+        journal.complete();
+
+def read_batch_list(batch_path, default_manifest):
+    """The (metadata, manifest, job run id) triples for a --batch run.
+    batch_path is either a directory, whose *.json files are all metadata
+    for default_manifest with no JobRun, or a text file with one
+    whitespace-separated "METADATA [MANIFEST [JOB_RUN_ID]]" per line
+    (blank lines and lines starting with # are skipped). Relative
+    filenames in the file are relative to the file's own directory."""
+    if os.path.isdir(batch_path):
+        if not default_manifest:
+            raise Exception("A --batch directory needs the MANIFEST argument.");
+        return [(os.path.join(batch_path,name),default_manifest,None)
+                for name in sorted(os.listdir(batch_path))
+                if name.endswith(".json")]
+    base=os.path.dirname(batch_path)
+    items=[]
+    with open(batch_path) as f:
+        for line_number,line in enumerate(f,1):
+            fields=line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields)>3:
+                raise Exception(f"{batch_path} line {line_number}: expected METADATA [MANIFEST [JOB_RUN_ID]]");
+            metadata=os.path.join(base,fields[0])
+            manifest=(os.path.join(base,fields[1]) if len(fields)>1
+                      else default_manifest)
+            if not manifest:
+                raise Exception(f"{batch_path} line {line_number}: no manifest, and no MANIFEST argument to default to");
+            items.append((metadata,manifest,fields[2] if len(fields)>2 else None))
+    return items
+
+def prepare_batch_item(metadata_filename, manifest_filename, mock_filename,
+                       stream, preflight_workers, nested_shards):
+    # Runs in a worker process: everything that doesn't need the Operend
+    # server. Returns the table and manifest along with what was printed,
+    # so the main process can print it with the rest of that file's output.
+    log=io.StringIO()
+    with contextlib.redirect_stdout(log):
+        table=load_cromwell_io(metadata_filename, stream, nested_shards);
+        with open(manifest_filename) as f:
+            manifest=IOMapping(json.load(f), mock_filename, preflight_workers);
+        manifest.dry_validate(table);
+    return table, manifest, log.getvalue()
+
+def batch_run(items, parsed_args, mode, dedup=None, nested_shards="array"):
+    """Ingests many metadata files in one process. Parsing and local
+    validation happen in a pool of --batch-workers processes, a few files
+    ahead of the main process, which does the rest of each file in turn
+    ("very_dry", "dry" or "full" run, like very_dry_run/dry_run/full_run)
+    with the one API configuration and schema cache. A failure is reported
+    and the batch carries on with the next file. Prints a summary at the
+    end, with the number of files that failed, and returns the exit
+    status: 1 if any failed, else 0."""
+    results=[]
+    window=collections.deque()
+    pending=iter(items)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=parsed_args.batch_workers) as pool:
+        def submit_next():
+            item=next(pending,None)
+            if item:
+                window.append((item,pool.submit(
+                    prepare_batch_item, item[0], item[1],
+                    parsed_args.mock_file, parsed_args.stream,
+                    parsed_args.preflight_workers, nested_shards)))
+        # Only keep a couple of parsed tables per worker waiting, rather
+        # than every table in the batch.
+        for _ in range(2*parsed_args.batch_workers):
+            submit_next()
+        while window:
+            (metadata_filename,manifest_filename,job_run_id),future=window.popleft()
+            submit_next()
+            print(f"=== {metadata_filename}")
+            try:
+                table,manifest,log=future.result()
+                print(log,end="")
+                if mode=="very_dry":
+                    dry_run_posts(table, manifest, job_run_id, dedup);
+                elif mode=="dry":
+                    manifest.validate(table, check_files=False);
+                    if job_run_id!=None:
+                        confirm_job_run_exists(job_run_id);
+                    dry_run_posts(table, manifest, job_run_id, dedup);
+                else:
+                    manifest.validate(table, check_files=False);
+                    job_run=None
+                    if job_run_id!=None:
+                        job_run=confirm_job_run_exists(job_run_id);
+                    journal=PostJournal(
+                        PostJournal.default_filename(
+                            metadata_filename, manifest_filename, None,
+                            parsed_args.ini or os.getenv('OPYRND_CONFIG')),
+                        metadata_filename, manifest_filename,
+                        parsed_args.resume);
+                    try:
+                        execute_posts(table, manifest, job_run_id,
+                                      parsed_args.upload_workers, journal,
+                                      dedup, parsed_args.entity_batch_size,
+                                      job_run);
+                        journal.complete();
+                    finally:
+                        journal.close();
+                results.append((metadata_filename,
+                                f"ok, {len(table.row_numbers)} rows"))
+            except Exception as e:
+                print(f"FAILED: {e}",file=sys.stderr)
+                results.append((metadata_filename,f"FAILED: {e}"))
+    failures=sum(1 for _,result in results if result.startswith("FAILED"))
+    print(f"\n=== Batch summary: {len(results)-failures} succeeded, {failures} failed")
+    for metadata_filename,result in results:
+        print(f"{metadata_filename}\t{result.splitlines()[0] if result else ''}")
+    # Not the count itself: exit statuses are taken mod 256.
+    return 1 if failures else 0
+
 def confirm_job_run_exists(job_run_id):
-    if not JobRun.get_by_system_id(job_run_id):
+    with metrics.phase("confirm_job_run"):
+        jr=JobRun.get_by_system_id(job_run_id);
+    if not jr:
         raise Exception(f"No job run found with id {job_run_id}");
+    return jr
     
 def dry_run_posts(table, manifest,
-                  job_run_id=None):
+                  job_run_id=None, dedup=None):
     next_wfid=101
     def mock_wfid():
         nonlocal next_wfid;
         this_wfid=next_wfid
         next_wfid = next_wfid+1;
         return this_wfid
+    def file_wfid(fname):
+        wfid=dedup.find(fname) if dedup else None
+        if wfid!=None:
+            print(f"would not be POSTing file {fname}, same content as earlier upload with wfid {wfid}");
+            return wfid
+        wfid=mock_wfid()
+        print(f"would be POSTing file {fname}... pretending it has wfid {wfid}");
+        return wfid
     jr_wfids={}
     for row in table.row_numbers:
         mock_entity={}
@@ -450,9 +2080,8 @@ def dry_run_posts(table, manifest,
                 if isinstance(fnames,list):
                     wfids=[]
                     for one in fnames:                        
-                        one_wfid=mock_wfid();
+                        one_wfid=file_wfid(one);
                         wfids.append(one_wfid)
-                        print(f"would be POSTing file {one}... pretending it has wfid {one_wfid}");           
                         if field_name in jr_wfids:                    
                             jr_wfids[field_name].append(one_wfid)
                         else:
@@ -460,8 +2089,7 @@ def dry_run_posts(table, manifest,
                     mock_entity[field_name]=wfids;                    
                 else:
                     fname=fnames
-                    wfid=mock_wfid()
-                    print(f"would be POSTing file {fname}... pretending it has wfid {wfid}");
+                    wfid=file_wfid(fname)
                     if field_name in jr_wfids:                    
                         jr_wfids[field_name].append(wfid)
                     else:
@@ -471,127 +2099,754 @@ def dry_run_posts(table, manifest,
     if job_run_id!=None:
         print(f"would be updating job run {job_run_id} with file outputs {jr_wfids}");
 
-def execute_posts(table, manifest, job_run_id=None):
+class EntityWriter:
+    """Saves the Entities execute_posts builds in batches of batch_size
+    rows rather than one blocking round-trip per row: a batch's saves are
+    sent concurrently, up to workers at a time, so the time spent goes
+    with the number of batches instead of the number of rows.
+
+    Entity ids are reported per row, in row order, as each batch finishes:
+    printed, and passed to on_saved(row, entity_id) if given. If some saves
+    in a batch fail, the ones that succeeded are still reported before the
+    first failure is raised."""
+    def __init__(self, batch_size=1, workers=8, on_saved=None):
+        self.batch_size=max(1,batch_size)
+        self.workers=workers
+        self.on_saved=on_saved
+        self.pending=[]
+        self.executor=None
+
+    def add(self, row, entity):
+        self.pending.append((row,entity))
+        if len(self.pending)>=self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch,self.pending=self.pending,[]
+        if not batch:
+            return
+        with metrics.phase("entity_saves"):
+            self.save(batch)
+
+    def save(self, batch):
+        if len(batch)==1:
+            row,entity=batch[0]
+            entity.save()
+            self.report(row,entity)
+            return
+        if not self.executor:
+            self.executor=concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers)
+        futures=[self.executor.submit(entity.save) for _,entity in batch]
+        error=None
+        for (row,entity),future in zip(batch,futures):
+            try:
+                future.result()
+            except Exception as e:
+                error=error or e
+                continue
+            self.report(row,entity)
+        if error:
+            raise error
+
+    def report(self, row, entity):
+        print(f"POSTed entity for row {row}, entity id {entity.entity_id}")
+        metrics.count("entities_saved")
+        if self.on_saved:
+            self.on_saved(row,entity.entity_id)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+
+def output_filenames(table, manifest, row):
+    """The Cromwell output filenames execute_posts uploads for one row,
+    in the order it uploads them."""
+    fnames=[]
+    for k in manifest.output_files:
+        if k in table.output_rows[row]:
+            if isinstance(table.output_rows[row][k],list):
+                fnames.extend(table.output_rows[row][k]);
+            else:
+                fnames.append(table.output_rows[row][k]);
+    return fnames
+
+def post_workfile(manifest, fname):
+    # Every file, however large, goes up in one request: opyrnd has no
+    # chunked or multipart upload call, and Operend no known endpoint for
+    # one, to send large files in parts through. When it does, this is the
+    # place to choose between the two by size (manifest.file_sizes has it).
+    wf=WorkFile.post_from_file(manifest.mock_filename or fname);
+    return wf.systemId
+
+class UploadDedupCache:
+    """Local index from file content to the wfid of a WorkFile already
+    holding that content, so the same bytes aren't uploaded twice: not
+    when Cromwell reports one file under several outputs or shards, and
+    not when a rerun workflow is ingested again.
+
+    Entries live in a SQLite file, keyed by file size plus a BLAKE2b hash
+    of the contents; dry runs don't hash files whose size has never been
+    seen, since those can't match. The least recently used entries are
+    evicted once there are more than max_entries.
+
+    It costs a second read of every file, for the hash, so it is only
+    used with --dedup. The index only knows what this machine uploaded to
+    the server named by the config it was opened for (see
+    default_filename()); a WorkFile deleted on the server afterwards will
+    still be handed out, so remove the cache file after deleting
+    WorkFiles. The default file is per host as well as per config: home
+    directories are often on NFS, where SQLite's locking can't be relied
+    on, so --partition workers on different nodes must not share one."""
+    hash_block_size=1<<20
+
+    def __init__(self, filename, max_entries=100000):
+        self.filename=filename
+        self.max_entries=max_entries
+        self.lock=threading.Lock()
+        self.key_locks={}
+        self.hits=0
+        directory=os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory,exist_ok=True)
+        self.db=sqlite3.connect(filename,check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS uploads ("
+                        "size INTEGER, hash TEXT, wfid TEXT, last_used REAL,"
+                        "PRIMARY KEY (size, hash))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS uploads_last_used "
+                        "ON uploads (last_used)")
+        self.db.commit()
+        self.entries=self.db.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    @staticmethod
+    def default_filename(ini_filename):
+        host=re.sub(r"[^A-Za-z0-9._-]+","_",socket.gethostname())
+        return config_cache_filename(ini_filename,"uploads",f"-{host}.sqlite")
+
+    def content_hash(self, fname):
+        return file_digest(fname,self.hash_block_size)
+
+    def size_known(self, size):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM uploads WHERE size=? LIMIT 1",
+                                   (size,)).fetchone()!=None
+
+    def lookup(self, size, digest, touch=True):
+        with self.lock:
+            found=self.db.execute(
+                "SELECT wfid FROM uploads WHERE size=? AND hash=?",
+                (size,digest)).fetchone()
+            if found and touch:
+                self.db.execute(
+                    "UPDATE uploads SET last_used=? WHERE size=? AND hash=?",
+                    (time.time(),size,digest))
+                self.db.commit()
+        return json.loads(found[0]) if found else None
+
+    def store(self, size, digest, wfid):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO uploads VALUES (?,?,?,?)",
+                            (size,digest,json.dumps(wfid),time.time()))
+            self.entries+=1
+            if self.entries>self.max_entries:
+                # Evict down to 90% so this isn't done on every upload.
+                self.db.execute(
+                    "DELETE FROM uploads WHERE rowid IN (SELECT rowid FROM "
+                    "uploads ORDER BY last_used LIMIT ?)",
+                    (self.entries-int(self.max_entries*0.9),))
+                self.entries=self.db.execute(
+                    "SELECT COUNT(*) FROM uploads").fetchone()[0]
+            self.db.commit()
+
+    def find(self, fname):
+        """The wfid of an earlier upload with this file's content, or None.
+        Doesn't touch the index; for dry runs."""
+        size=os.path.getsize(fname)
+        if not self.size_known(size):
+            return None
+        return self.lookup(size,self.content_hash(fname),touch=False)
+
+    def post(self, fname, post_file):
+        """Returns (wfid, reused): the wfid of an earlier upload of the same
+        content, or else the result of post_file(), which is then indexed.
+        Concurrent calls for the same content wait for each other, so the
+        upload pool doesn't send one file twice at once."""
+        size=os.path.getsize(fname)
+        digest=self.content_hash(fname)
+        with self.lock:
+            key_lock=self.key_locks.setdefault((size,digest),threading.Lock())
+        with key_lock:
+            wfid=self.lookup(size,digest)
+            if wfid!=None:
+                with self.lock:
+                    self.hits+=1
+                return wfid, True
+            wfid=post_file()
+            self.store(size,digest,wfid)
+            return wfid, False
+
+    def close(self):
+        self.db.close()
+
+class PostJournal:
+    """Append-only record of what execute_posts has written to Operend for
+    one metadata file + manifest: the wfid of every uploaded file and the
+    entity id of every saved row. Each record is a JSON line that is
+    fsync'd before execute_posts moves on, so after a crash the journal
+    never claims more than actually happened.
+
+    A journal opened with resume=True loads the records of the earlier run;
+    execute_posts then reuses those wfids and skips those rows instead of
+    posting duplicates. Only records from the earlier run count for that;
+    what this run records is not consulted again, so a resumed run makes
+    the same posts the interrupted run would have made from that point.
+    Uploads are recorded as they finish, including ones still in flight
+    in the upload pool when a row fails.
+
+    Once the run has finished, JobRun included, complete() marks the
+    journal so. Without --resume, a journal marked complete is replaced
+    by a new one rather than refused, so the same ingest can simply be
+    run again; only an unfinished one needs --resume or removing."""
+    def __init__(self, filename, metadata_filename, manifest_filename,
+                 resume=False):
+        self.filename=filename
+        self.key={"metadata":metadata_filename if "://" in metadata_filename
+                  else os.path.abspath(metadata_filename),
+                  "manifest":self.manifest_digest(manifest_filename)}
+        self.wfids={}
+        self.entities={}
+        self.lock=threading.Lock()
+        exists=os.path.exists(filename) and os.path.getsize(filename)>0
+        if exists and not resume:
+            if not self.is_complete(filename):
+                raise Exception(f"Journal {filename} exists from an earlier run that didn't finish; pass --resume to continue that run, or remove the journal to start over.");
+            print(f"journal {filename} is from an earlier run that finished; starting a new one");
+            os.remove(filename)
+            exists=False
+        if exists:
+            self.load()
+        os.makedirs(os.path.dirname(os.path.abspath(filename)),exist_ok=True)
+        self.out=open(filename,"a")
+        if not exists:
+            self.append(self.key)
+
+    @staticmethod
+    def default_filename(metadata_filename, manifest_filename, partition=None,
+                         ini_filename=None):
+        # Next to the metadata file, unless its directory can't be written
+        # to and ini_filename is given, in which case it goes in the
+        # cache directory for that config, named after the metadata file's
+        # path so different metadata files don't share one.
+        digest=PostJournal.manifest_digest(manifest_filename)[:12]
+        if "://" in metadata_filename:
+            # --watch of a Cromwell server: journal in the current directory.
+            metadata_filename=re.sub(r"[^A-Za-z0-9._-]+","_",metadata_filename)
+        if partition:
+            # Each --partition worker keeps a journal of its own.
+            filename=f"{metadata_filename}.{digest}.part{partition[0]}of{partition[1]}.journal"
+        else:
+            filename=f"{metadata_filename}.{digest}.journal"
+        directory=os.path.dirname(os.path.abspath(filename))
+        if ini_filename and not os.access(directory,os.W_OK):
+            path_digest=hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:12]
+            filename=config_cache_filename(
+                ini_filename,"journal",
+                f"-{path_digest}-{os.path.basename(filename)}")
+        return filename
+
+    @staticmethod
+    def is_complete(filename):
+        # Whether the last record of the journal is complete()'s.
+        with open(filename,"rb") as f:
+            f.seek(max(0,os.path.getsize(filename)-4096))
+            lines=[line for line in f.read().split(b"\n") if line.strip()]
+        try:
+            return bool(lines) and json.loads(lines[-1])=={"complete":True}
+        except ValueError:
+            return False
+
+    @staticmethod
+    def manifest_digest(manifest_filename):
+        with open(manifest_filename,"rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def load(self):
+        with open(self.filename) as f:
+            lines=f.read().split("\n")
+        records=[]
+        for n,line in enumerate(lines):
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn last line is what a crash mid-append leaves behind;
+                # anything else means the journal isn't ours to trust.
+                if any(lines[n+1:]):
+                    raise Exception(f"Journal {self.filename} is corrupt at line {n+1}");
+        if not records or records[0]!=self.key:
+            raise Exception(f"Journal {self.filename} was written for a different metadata file or manifest.");
+        for record in records[1:]:
+            if isinstance(record.get("row"),list):
+                record["row"]=tuple(record["row"]) # see CromwellIO nested_shards
+            if "wfid" in record:
+                self.wfids[(record["row"],record["file"])]=record["wfid"]
+            elif "entity" in record:
+                self.entities[record["row"]]=record["entity"]
+
+    def append(self, record):
+        # Upload threads record their wfids as soon as they have them.
+        with self.lock:
+            self.out.write(json.dumps(record)+"\n")
+            self.out.flush()
+            os.fsync(self.out.fileno())
+
+    def previous_wfid(self, row, fname):
+        return self.wfids.get((row,fname))
+
+    def previous_entity(self, row):
+        return self.entities.get(row)
+
+    def record_wfid(self, row, fname, wfid):
+        self.append({"row":row,"file":fname,"wfid":wfid})
+
+    def record_entity(self, row, entity_id):
+        self.append({"row":row,"entity":entity_id})
+
+    def complete(self):
+        # The whole run, JobRun update included, went through.
+        if self.out.closed:
+            self.out=open(self.filename,"a")
+        self.append({"complete":True})
+        self.out.close()
+
+    def close(self):
+        self.out.close()
+
+def execute_posts(table, manifest, job_run_id=None, upload_workers=1,
+                  journal=None, dedup=None, entity_batch_size=1,
+                  job_run=None, job_run_updater=None):
+    # The JobRun gets its file outputs as they are posted, through
+    # job_run_updater if the caller has one going (--watch, where posting
+    # is spread over several calls, or a PartitionOutputs for --partition),
+    # or else one made here for job_run_id, which marks the JobRun
+    # COMPLETE at the end.
     jr_wfids={}
-    for row in table.row_numbers:
-        entity_variables={}
-        for k in manifest.input_values:
-            if k in table.input_rows[row] and table.input_rows[row][k]!=None:
-                entity_variables[manifest.input_values[k]]=\
-                    table.input_rows[row][k]
-        for k in manifest.output_values:
-            if k in table.output_rows[row] and table.output_rows[row][k]!=None:
-                entity_variables[manifest.output_values[k]]=\
-                    table.output_rows[row][k]
-        for k in manifest.output_files:
-            if k in table.output_rows[row]:
-                field_name=manifest.output_files[k];
-                fnames=table.output_rows[row][k];
-                if isinstance(fnames,list):
-                    wfids=[];
-                    for one in fnames:
-                        if manifest.mock_filename:
-                            real_fname=manifest.mock_filename
-                            print(f"POSTing file {one} (really {real_fname}...",end="")
-                        else:
-                            real_fname=one
-                            print(f"POSTING file {one}...",end="");
-                        one_wf=WorkFile.post_from_file(real_fname);
-                        one_wfid=one_wf.systemId;
-                        wfids.append(one_wfid);
-                        print(f" wfid {one_wfid}")
-                        if field_name in jr_wfids:
-                            jr_wfids[field_name].append(one_wfid)
-                        else:
-                            jr_wfids[field_name]=[one_wfid];
-                    entity_variables[field_name]=wfids;
-                else:
-                    fname=fnames;
-                    if manifest.mock_filename:
-                        real_fname=manifest.mock_filename
-                        print(f"POSTing file {fname} (really {real_fname}...",end="")
-                    else:
-                        real_fname=fname
-                        print(f"POSTING file {fname}...",end="");
-                    wf=WorkFile.post_from_file(real_fname);
-                    wfid=wf.systemId;
-                    print(f" wfid {wfid}")
-                    if field_name in jr_wfids:
-                        jr_wfids[field_name].append(wfid)
+    finish_job_run=False
+    if job_run_updater==None and job_run_id!=None:
+        job_run_updater=JobRunUpdater(job_run_id, job_run,
+                                      len(table.row_numbers));
+        finish_job_run=True
+    entities=EntityWriter(entity_batch_size,
+                          on_saved=journal.record_entity if journal else None)
+    executor=None
+    uploads=collections.deque()
+    def upload(row, fname):
+        start=time.perf_counter()
+        if dedup:
+            wfid,reused=dedup.post(manifest.mock_filename or fname,
+                                   lambda: post_workfile(manifest,fname));
+        else:
+            wfid,reused=post_workfile(manifest,fname),False
+        if metrics.enabled:
+            metrics.record_upload(fname, time.perf_counter()-start,
+                                  os.path.getsize(manifest.mock_filename or fname),
+                                  reused);
+        if journal:
+            journal.record_wfid(row,fname,wfid);
+        return wfid,reused
+    if upload_workers>1:
+        # Queue every file of the run up front, in the same order the row
+        # loop below asks for them, so up to upload_workers uploads are in
+        # flight at once. Rows are still built and saved one at a time and
+        # in order, each only once its own files have wfids, so everything
+        # after the uploads comes out the same as the serial path.
+        executor=concurrent.futures.ThreadPoolExecutor(
+            max_workers=upload_workers)
+        for row in table.row_numbers:
+            for fname in output_filenames(table, manifest, row):
+                if journal and journal.previous_wfid(row,fname)!=None:
+                    continue
+                uploads.append(executor.submit(upload,row,fname))
+    def post_file(row, fname):
+        if journal and journal.previous_wfid(row,fname)!=None:
+            wfid=journal.previous_wfid(row,fname)
+            print(f"file {fname} already POSTed, wfid {wfid}")
+            return wfid
+        if manifest.mock_filename:
+            print(f"POSTing file {fname} (really {manifest.mock_filename}...",end="")
+        else:
+            print(f"POSTING file {fname}...",end="");
+        with metrics.phase("uploads"):
+            if executor:
+                wfid,reused=uploads.popleft().result();
+            else:
+                wfid,reused=upload(row,fname);
+        if reused:
+            print(f" same content as earlier upload, wfid {wfid}")
+        else:
+            print(f" wfid {wfid}")
+        return wfid
+    try:
+        for row in table.row_numbers:
+            entity_variables={}
+            row_wfids={}
+            for k in manifest.input_values:
+                if k in table.input_rows[row] and table.input_rows[row][k]!=None:
+                    entity_variables[manifest.input_values[k]]=\
+                        table.input_rows[row][k]
+            for k in manifest.output_values:
+                if k in table.output_rows[row] and table.output_rows[row][k]!=None:
+                    entity_variables[manifest.output_values[k]]=\
+                        table.output_rows[row][k]
+            for k in manifest.output_files:
+                if k in table.output_rows[row]:
+                    field_name=manifest.output_files[k];
+                    fnames=table.output_rows[row][k];
+                    if isinstance(fnames,list):
+                        wfids=[];
+                        for one in fnames:
+                            one_wfid=post_file(row,one);
+                            wfids.append(one_wfid);
+                            if field_name in row_wfids:
+                                row_wfids[field_name].append(one_wfid)
+                            else:
+                                row_wfids[field_name]=[one_wfid];
+                        entity_variables[field_name]=wfids;
                     else:
-                        jr_wfids[field_name]=[wfid];
-                    entity_variables[field_name]=wfid;
-        entity=Entity(manifest.entity_class,values=entity_variables)
-        print(f"POSTing entity {json.dumps(entity.to_dict())}...",end="");
-        entity.save();
-        print(f" entity id {entity.entity_id}")
-    if job_run_id!=None:
-        jr=JobRun.get_by_system_id(job_run_id);
-        mergeOutputWorkFileIds(jr,jr_wfids);
-        jr.status="COMPLETE"
-        print(f"updating job run {job_run_id} with file outputs {jr_wfids}... ",end="");        
-        jr.save();
-        print("complete")
+                        wfid=post_file(row,fnames);
+                        if field_name in row_wfids:
+                            row_wfids[field_name].append(wfid)
+                        else:
+                            row_wfids[field_name]=[wfid];
+                        entity_variables[field_name]=wfid;
+            for field_name in row_wfids:
+                jr_wfids.setdefault(field_name,[]).extend(row_wfids[field_name])
+            if job_run_updater:
+                job_run_updater.add(row_wfids, row);
+            if journal and journal.previous_entity(row)!=None:
+                print(f"row {row} already POSTed, entity id {journal.previous_entity(row)}")
+                continue
+            entities.add(row,Entity(manifest.entity_class,
+                                    values=entity_variables));
+        entities.flush();
+    finally:
+        entities.close();
+        if executor:
+            # On failure, don't start uploads nobody is waiting for; the
+            # ones already running finish and are journaled.
+            executor.shutdown(cancel_futures=True);
+    if dedup and dedup.hits:
+        print(f"{dedup.hits} files matched the content of earlier uploads and were not uploaded again")
+    if finish_job_run:
+        job_run_updater.finish();
+    return jr_wfids
+
+# Defaults for how often JobRunUpdater saves, set from the command line.
+job_run_update_files=5000
+job_run_update_seconds=60
+
+class JobRunUpdater:
+    """Keeps the JobRun up to date with the file outputs of a run as they
+    are posted, rather than saving them all in one go at the end: after
+    every_files new wfids or every_seconds, whichever comes first, the
+    new wfids are merged into the JobRun's outputWorkFileIds and it is
+    saved, with a progress line printed. Its status is left alone until
+    finish(), which saves whatever is left and marks it COMPLETE; if the
+    run fails, the JobRun has the outputs posted so far and isn't marked
+    COMPLETE.
+
+    add() takes one row's {field name: [wfids]} at a time (the row
+    number is for the benefit of PartitionOutputs, which takes the same
+    calls, and isn't needed here); rows_expected,
+    if known, is only for the progress line. job_run is the JobRun if the
+    caller already fetched it to check it exists."""
+    def __init__(self, job_run_id, job_run=None, rows_expected=None,
+                 every_files=None, every_seconds=None):
+        self.job_run_id=job_run_id
+        self.job_run=job_run
+        self.rows_expected=rows_expected
+        self.every_files=job_run_update_files if every_files==None else every_files
+        self.every_seconds=job_run_update_seconds if every_seconds==None else every_seconds
+        self.pending={}
+        self.pending_files=0
+        self.rows=0
+        self.files=0
+        self.seen={}
+        self.last_save=time.monotonic()
+
+    def add(self, row_wfids, row=None):
+        for field_name,wfids in row_wfids.items():
+            self.pending.setdefault(field_name,[]).extend(wfids)
+            self.pending_files+=len(wfids)
+        self.rows+=1
+        if (self.pending_files>=self.every_files or
+                time.monotonic()-self.last_save>=self.every_seconds):
+            self.save()
+
+    def save(self, complete=False):
+        with metrics.phase("job_run_update"):
+            if self.job_run==None:
+                self.job_run=JobRun.get_by_system_id(self.job_run_id);
+            mergeOutputWorkFileIds(self.job_run,self.pending,self.seen);
+            self.files+=self.pending_files
+            of_rows=f" of {self.rows_expected}" if self.rows_expected!=None else ""
+            if complete:
+                self.job_run.status="COMPLETE"
+                print(f"updating job run {self.job_run_id} with the last file outputs, {self.files} from {self.rows}{of_rows} rows in all... ",end="");
+            else:
+                print(f"updating job run {self.job_run_id} with file outputs so far, {self.files} from {self.rows}{of_rows} rows... ",end="");
+            self.job_run.save();
+            metrics.count("job_run_updates")
+        print("complete" if complete else "done")
+        self.pending={}
+        self.pending_files=0
+        self.last_save=time.monotonic()
+
+    def finish(self):
+        self.save(complete=True)
 
-def mergeOutputWorkFileIds(jr,wfids_in):
+def mergeOutputWorkFileIds(jr,wfids_in,seen=None):
+    # Appends the wfids in wfids_in to the JobRun's outputWorkFileIds,
+    # field by field, leaving out ones already there and keeping the
+    # order they come in. seen is a dict of the wfids already in each
+    # field, which this builds as it goes; callers merging more than once
+    # into the same JobRun pass the same one each time, so that each merge
+    # costs only the wfids it adds.
     if hasattr(jr,"outputWorkFileIds"):
         wfids_out=jr.outputWorkFileIds;
         if not wfids_out:
             wfids_out={}
     else:
         wfids_out={}
+    if seen==None:
+        seen={}
     for k in wfids_in:
         if k not in wfids_out:
             wfids_out[k]=[]
+        if k not in seen:
+            seen[k]=set(wfids_out[k])
+        field_seen=seen[k]
         for v in wfids_in[k]:
-            if v not in wfids_out[k]:
+            if v not in field_seen:
+                field_seen.add(v)
                 wfids_out[k].append(v)
     jr.outputWorkFileIds=wfids_out;
         
 def main(argv):
     parser=argparse.ArgumentParser();
-    parser.add_argument('METADATA', help="Filename of Cromwell metadata JSON, as output from Cromwell's -m.")
+    parser.add_argument('METADATA', help="Filename of Cromwell metadata JSON, as output from Cromwell's -m. (With --batch, a directory of them or a file listing them.)")
     parser.add_argument('MANIFEST', nargs='?', help="Filename of JSON mapping from Cromwell field names to Operend entity schema. (Required except for --list)");
     parser.add_argument('JOB_RUN_ID', nargs="?", help="Operend ID of JobRun to update. If omitted, only Entities will be posted to Operend, with no JobRun update.");
     parser.add_argument('-i','--ini',help='ini file for Operend credentials. If omitted, looks for filename in OPYRND_CONFIG environment variable.')
     parser.add_argument('-l','--list',action='store_true',help='Just lists the inputs and outputs found in the Cromwell metadata, with one example value each, and exits.');
+    parser.add_argument('--list-shards',type=int,metavar='N',help='with --list, read only the first N shards of each call.');
+    parser.add_argument('--list-early-stop',action='store_true',help="with --list, stop reading each call's shards once they stop turning up new names or example values.");
+    parser.add_argument('--json',action='store_true',help='with --list, print the names, example values, types and array-ness as JSON, for scripting manifests.');
+    parser.add_argument('--export',metavar='FILE',help="Just writes the table of input and output values, one row per shard, to FILE as TSV, CSV, Parquet or Arrow (going by its extension), and exits. Arrays are written as JSON in TSV and CSV.");
+    parser.add_argument('--export-format',choices=['tsv','csv','parquet','arrow'],help='format for --export, if its extension doesn\'t say. Parquet and Arrow need pyarrow installed.');
+    parser.add_argument('--export-columns',metavar='NAME,...',help='with --export, just these input and output names, in this order (default: all of them, except names containing secret, token or password).');
     parser.add_argument('--dry-run',action='store_true',help='validates against Operend server, but just print instead of writing output to the server.');
     parser.add_argument('--very-dry-run',action='store_true',help='do not contact Operend server, just validate as far as possible without doing that and print');
+    parser.add_argument('--stream',action='store_true',help='read the metadata file incrementally instead of loading it all at once; use this for multi-gigabyte metadata that would otherwise run out of memory.');
+    parser.add_argument('--upload-workers',type=int,default=1,metavar='N',help='upload up to N output files at once (default 1). Entities and the JobRun are still written in the same order as with one worker.');
+    parser.add_argument('--journal',help='file recording every WorkFile and Entity posted, so an interrupted run can be resumed. Defaults to METADATA.<manifest hash>.journal, or a file under ~/.cache/cromwell2operend if the directory of METADATA can\'t be written to.');
+    parser.add_argument('--resume',action='store_true',help='continue an interrupted run from its journal, skipping files and entities it already posted.');
+    parser.add_argument('--entity-batch-size',type=int,default=1,metavar='N',help="save entities N rows at a time, sending each batch's saves concurrently (default 1).");
+    parser.add_argument('--schema-cache-ttl',type=float,default=0,metavar='SECONDS',help='reuse entity class definitions fetched by earlier runs for up to SECONDS, instead of fetching them from the server every run (default 0, off).');
+    parser.add_argument('--dedup',action='store_true',help="don't upload output files whose content matches a file uploaded before from this host, reusing that WorkFile instead. Every file is read an extra time to hash it.");
+    parser.add_argument('--no-dedup',action='store_true',help="upload every output file (the default; overrides --dedup).");
+    parser.add_argument('--dedup-cache',help='SQLite file indexing the content of uploaded files by wfid, for --dedup. Defaults to a per-config, per-host file under ~/.cache/cromwell2operend; keep it on a local disk, not NFS.');
+    parser.add_argument('--dedup-max-entries',type=int,default=100000,metavar='N',help='evict the least recently used entries from the dedup cache beyond N (default 100000).');
+    parser.add_argument('--preflight-workers',type=int,default=16,metavar='N',help='check that output files exist and are readable using N threads (default 16).');
+    parser.add_argument('--nested-shards',choices=['array','rows'],default='array',help="what to do with a scatter nested inside the scatter that defines the rows: collect its outputs into arrays on the row (the default), or make each of its shards a row of its own.");
+    parser.add_argument('--nested-shards-for',action='append',default=[],metavar='CALL=RULE',help="--nested-shards rule (array or rows) for just the call with this Cromwell call key; may be repeated.");
+    parser.add_argument('--batch',action='store_true',help='METADATA is a directory of metadata files that all use MANIFEST, or a file with one "METADATA [MANIFEST [JOB_RUN_ID]]" per line; ingest them all in this one process, and print a summary of which succeeded.');
+    parser.add_argument('--batch-workers',type=int,default=os.cpu_count() or 1,metavar='N',help='with --batch, parse and check up to N metadata files at once in worker processes (default: number of CPUs).');
+    parser.add_argument('--metrics-out',metavar='JSON',help='write a report of where the time went (per-phase wall time, per-file upload latency and size, entities saved per second, retries) to this JSON file, even if the run fails.');
+    parser.add_argument('--metrics-textfile',metavar='PROM',help='also write the totals from that report in Prometheus textfile-collector format to this file (name it *.prom in the node_exporter textfile directory).');
+    parser.add_argument('--watch',action='store_true',help='ingest a workflow while it is still running: METADATA is either the URL of the workflow on a Cromwell server (http://HOST:PORT/api/workflows/v1/WORKFLOW_ID) or a metadata file that is being rewritten as the workflow goes. Rows are posted as their shards reach Done, and the JobRun is updated once the workflow finishes.');
+    parser.add_argument('--watch-interval',type=float,default=30,metavar='SECONDS',help='with --watch, how often to poll the metadata (default 30).');
+    parser.add_argument('--watch-timeout',type=float,metavar='SECONDS',help='with --watch, give up if the workflow hasn\'t finished after this long (default: never).');
+    parser.add_argument('--parse-cache',action='store_true',help='keep the tables parsed from metadata files in an on-disk cache, so that later runs on the same unchanged file (say --very-dry-run, then --dry-run, then the real run) skip parsing it.');
+    parser.add_argument('--parse-cache-dir',help='directory for --parse-cache (default ~/.cache/cromwell2operend/parsed).');
+    parser.add_argument('--parse-cache-max-bytes',type=int,default=2<<30,metavar='N',help='remove the least recently used --parse-cache entries beyond N bytes in total (default 2 GiB).');
+    parser.add_argument('--http-pool-size',type=int,metavar='N',help='keep up to N connections to the Operend server open for reuse (default: enough for --upload-workers and --entity-batch-size).');
+    parser.add_argument('--http-connect-timeout',type=float,default=10,metavar='SECONDS',help='give up connecting to the Operend server after this long (default 10).');
+    parser.add_argument('--http-read-timeout',type=float,default=300,metavar='SECONDS',help='give up waiting for a response from the Operend server after this long (default 300).');
+    parser.add_argument('--job-run-update-files',type=int,default=5000,metavar='N',help='save the file outputs posted so far to the JobRun after every N files (default 5000); it is marked COMPLETE after the last ones.');
+    parser.add_argument('--job-run-update-seconds',type=float,default=60,metavar='SECONDS',help='also save them at least this often (default 60).');
+    parser.add_argument('--partition',metavar='i/N',help='post only the i-th of N slices of the rows (i from 1), so N workers, on one node or several that see the same files, can share one run. Each keeps its own journal, and leaves the wfids it posted in a file for --finalize-partitions instead of updating the JobRun.');
+    parser.add_argument('--finalize-partitions',type=int,metavar='N',help='once all N --partition workers have finished, merge the wfids they posted into the JobRun JOB_RUN_ID and mark it COMPLETE.');
+    parser.add_argument('--partition-dir',help='directory for the --partition wfid files (default: next to METADATA); must be the same for the workers and --finalize-partitions.');
+    parser.add_argument('--max-retries',type=int,default=5,metavar='N',help='retry a request the Operend server turns away (429, 503 and the like) or that fails to connect up to N times, backing off exponentially (default 5). Uploads and Entity and JobRun saves are only retried when they cannot have taken effect.');
+    parser.add_argument('--retry-max-delay',type=float,default=60,metavar='SECONDS',help='longest wait between retries, unless the server asks for longer with Retry-After (default 60).');
+    parser.add_argument('--no-adaptive-concurrency',action='store_true',help='always keep as many requests in flight as there are workers, instead of backing off when the server pushes back and building up again while it keeps up.');
     parser.add_argument('--mock-file',help="use this filename for all file uploads, instead of the actual Cromwell output file (CAUTION: If you don't also --dry-run or --very-dry-run, this will end up sending the mock data to the Operend server, annotated like it's real!)")
     if len(argv)==0:
         parser.print_help();
         return;
     parsed_args=parser.parse_args(argv[1:]);
+    if not parsed_args.metrics_out and not parsed_args.metrics_textfile:
+        return run_command(parser, parsed_args);
+    global metrics
+    metrics=RunMetrics(enabled=True)
+    try:
+        with metrics.phase("total"):
+            return run_command(parser, parsed_args);
+    except BaseException as e:
+        metrics.error=f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        metrics.write(parsed_args.metrics_out, parsed_args.metrics_textfile);
+
+def count_retry(call_type):
+    metrics.count("retries")
+    metrics.count(f"retries_{call_type}")
+
+def run_command(parser, parsed_args):
+    if parsed_args.parse_cache or parsed_args.parse_cache_dir:
+        global parse_cache
+        parse_cache=ParsedMetadataCache(parsed_args.parse_cache_dir,
+                                        parsed_args.parse_cache_max_bytes)
+    nested_shards=parsed_args.nested_shards
+    if parsed_args.nested_shards_for:
+        nested_shards={"*":parsed_args.nested_shards}
+        for rule in parsed_args.nested_shards_for:
+            call_key,_,mode=rule.rpartition("=")
+            if not call_key or mode not in ("array","rows"):
+                parser.error(f"--nested-shards-for expects CALL=array or CALL=rows, not {rule}")
+            nested_shards[call_key]=mode
+    if parsed_args.watch and (parsed_args.batch or parsed_args.list or
+                              parsed_args.export):
+        parser.error("--watch can't be combined with --batch, --list or --export.");
     if parsed_args.list:
-        list_metadata(parsed_args.METADATA)
+        list_metadata(parsed_args.METADATA, parsed_args.stream, nested_shards,
+                      parsed_args.list_shards, parsed_args.list_early_stop,
+                      parsed_args.json)
         return;
-    if not parsed_args.MANIFEST:
+    if parsed_args.export:
+        table=load_cromwell_io(parsed_args.METADATA, parsed_args.stream,
+                               nested_shards);
+        export_table(table, parsed_args.export, parsed_args.export_format,
+                     parsed_args.export_columns.split(",")
+                     if parsed_args.export_columns else None);
+        return;
+    partition=None
+    if parsed_args.partition:
+        if parsed_args.watch or parsed_args.batch or parsed_args.finalize_partitions:
+            parser.error("--partition can't be combined with --watch, --batch or --finalize-partitions.");
+        try:
+            partition=parse_partition(parsed_args.partition)
+        except ValueError as e:
+            parser.error(f"--partition: {e}");
+    if parsed_args.finalize_partitions!=None:
+        if parsed_args.finalize_partitions<1 or not parsed_args.MANIFEST or parsed_args.JOB_RUN_ID==None:
+            parser.error("--finalize-partitions N needs N >= 1, and METADATA, MANIFEST and JOB_RUN_ID as given to the workers.");
+    if parsed_args.batch:
+        if parsed_args.list or parsed_args.JOB_RUN_ID or parsed_args.journal:
+            parser.error("--batch takes job run ids from the batch list, and does not support --list or --journal.");
+        batch_items=read_batch_list(parsed_args.METADATA, parsed_args.MANIFEST);
+    elif not parsed_args.MANIFEST:
         parser.print_help();
         print("For the requested usage, the MANIFEST argument is required.");
         return;
+    ini=parsed_args.ini or os.getenv('OPYRND_CONFIG')
+    # With --mock-file every upload has the same content, so dedup would
+    # collapse them all into one WorkFile.
+    dedup=None
+    if parsed_args.dedup and not parsed_args.no_dedup and not parsed_args.mock_file:
+        dedup_filename=parsed_args.dedup_cache
+        if not dedup_filename and ini:
+            dedup_filename=UploadDedupCache.default_filename(ini)
+        if dedup_filename:
+            dedup=UploadDedupCache(dedup_filename,
+                                   parsed_args.dedup_max_entries)
+    if parsed_args.finalize_partitions!=None and parsed_args.very_dry_run:
+        print(f"would be merging the wfids of {parsed_args.finalize_partitions} partitions into job run {parsed_args.JOB_RUN_ID}");
+        return;
+    if parsed_args.watch and parsed_args.very_dry_run:
+        return watch_run(parsed_args.METADATA, parsed_args.MANIFEST,
+                         parsed_args.JOB_RUN_ID, "very_dry", parsed_args,
+                         dedup, nested_shards);
+    if parsed_args.batch and parsed_args.very_dry_run:
+        return batch_run(batch_items, parsed_args, "very_dry", dedup,
+                         nested_shards);
     if parsed_args.very_dry_run:
         very_dry_run(parsed_args.METADATA,
                      parsed_args.MANIFEST,
                      parsed_args.JOB_RUN_ID,
-                     parsed_args.mock_file);
+                     parsed_args.mock_file,
+                     parsed_args.stream,
+                     dedup,
+                     parsed_args.preflight_workers,
+                     nested_shards,
+                     partition);
         return;
-    ini=parsed_args.ini or os.getenv('OPYRND_CONFIG')
     if not ini:
         parser.print_help();
         print("For the requested usage, either the --ini argument or OPYRND_CONFIG environment variable is required.");
         return;
     ApiBacked.configure_from_file(ini);
+    # Connections for the upload pool, the entity saves and the main thread.
+    operend_session.install_session(
+        parsed_args.http_pool_size or
+        parsed_args.upload_workers+(8 if parsed_args.entity_batch_size>1 else 1)+1,
+        parsed_args.http_connect_timeout, parsed_args.http_read_timeout,
+        parsed_args.max_retries, parsed_args.retry_max_delay,
+        not parsed_args.no_adaptive_concurrency, count_retry);
+    global schema_cache, job_run_update_files, job_run_update_seconds
+    job_run_update_files=parsed_args.job_run_update_files
+    job_run_update_seconds=parsed_args.job_run_update_seconds
+    schema_cache=SchemaCache(
+        config_cache_filename(ini,"entity-classes",".json"),
+        parsed_args.schema_cache_ttl);
+    if parsed_args.finalize_partitions!=None:
+        if parsed_args.dry_run:
+            confirm_job_run_exists(parsed_args.JOB_RUN_ID);
+            print(f"would be merging the wfids of {parsed_args.finalize_partitions} partitions into job run {parsed_args.JOB_RUN_ID}");
+            return;
+        finalize_partitions(parsed_args.METADATA, parsed_args.MANIFEST,
+                            parsed_args.JOB_RUN_ID,
+                            parsed_args.finalize_partitions,
+                            parsed_args.partition_dir);
+        return;
+    if parsed_args.watch:
+        return watch_run(parsed_args.METADATA, parsed_args.MANIFEST,
+                         parsed_args.JOB_RUN_ID,
+                         "dry" if parsed_args.dry_run else "full",
+                         parsed_args, dedup, nested_shards);
+    if parsed_args.batch:
+        return batch_run(batch_items, parsed_args,
+                         "dry" if parsed_args.dry_run else "full", dedup,
+                         nested_shards);
     if parsed_args.dry_run:
         dry_run(parsed_args.METADATA,
                 parsed_args.MANIFEST,
                 parsed_args.JOB_RUN_ID,
-                parsed_args.mock_file);
+                parsed_args.mock_file,
+                parsed_args.stream,
+                dedup,
+                parsed_args.preflight_workers,
+                nested_shards,
+                partition);
         return;
     full_run(parsed_args.METADATA,
              parsed_args.MANIFEST,
              parsed_args.JOB_RUN_ID,
-             parsed_args.mock_file);
+             parsed_args.mock_file,
+             parsed_args.stream,
+             parsed_args.upload_workers,
+             parsed_args.journal or PostJournal.default_filename(
+                 parsed_args.METADATA, parsed_args.MANIFEST, partition, ini),
+             parsed_args.resume,
+             dedup,
+             parsed_args.entity_batch_size,
+             parsed_args.preflight_workers,
+             nested_shards,
+             partition,
+             parsed_args.partition_dir);
 
 if __name__=="__main__":
-    main(sys.argv)
+    sys.exit(main(sys.argv))
 
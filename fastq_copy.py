@@ -1,43 +1,96 @@
 #!/usr/bin/python3
+import operend_session
 from opyrnd.api_backed import ApiBacked
 from opyrnd.entities import Entity
 from opyrnd.workfile import WorkFile
 import argparse
+import concurrent.futures
+import itertools
 import os
 
-def copy_fastqs(api_base_url, api_token_secret, api_verify_https,
-                fastq_query, temp_workfile_dir):
-    cfg = {'api_base_url': api_base_url,
-           "api_token_secret": api_token_secret,
-           'verify_https': api_verify_https}
 
-    ApiBacked.configure_from_dict(cfg)
-    tsv_file = open(f"{temp_workfile_dir}/this_tsv_file.tsv", "w")
-    tsv_file.write('SAMPLE_ID\tR1_ID\tR2_ID\tR1_NAME\tR2_NAME\n')
+class WorkFileNames:
+    # originalName of WorkFiles by system id, looked up concurrently and
+    # remembered, so a page of entities costs one round of parallel lookups
+    # rather than one serial lookup per file, and an id shared between
+    # entities is only looked up once. Only the most recent max_names are
+    # remembered, so the memo doesn't grow with the size of the query.
+    def __init__(self, workers=16, max_names=10000):
+        self.max_names = max_names
+        self.names = {}
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def resolve(self, workfile_ids):
+        new_ids = [i for i in dict.fromkeys(workfile_ids) if i not in self.names]
+        for workfile_id, wf in zip(new_ids, self.pool.map(WorkFile.get_by_system_id, new_ids)):
+            self.names[workfile_id] = wf.originalName
+        if len(self.names) > self.max_names:
+            # dicts keep insertion order, so this drops the oldest.
+            wanted = set(workfile_ids)
+            for workfile_id in list(itertools.islice(self.names, len(self.names) - self.max_names)):
+                if workfile_id not in wanted:
+                    del self.names[workfile_id]
+        return self.names
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def fastq_row(ent):
     # expecting an entity that returns the fastq workfiles in
     # an array: [r1,r2]
     # Assumes at least r1 MUST Exist
-    entities = Entity.get_by_query_params(fastq_query)
-    for ent in entities:
-        wf_1_name = ""
-        wf_2_name = ""
-        wf_array = ent.__getitem__('workFiles')
-        r1 = wf_array[0]
-        wf_1_name = WorkFile.get_by_system_id(r1).originalName
+    wf_array = ent.__getitem__('workFiles')
+    r1 = wf_array[0]
+    r2 = wf_array[1] if len(wf_array) > 1 else ""
+    samp_name = ent.__getitem__('name')
+    # need to update this logic when updating the data model
+    # oh boy - this better just be temp!
+    if "/" in samp_name:
+        samp_name = samp_name.split("/")[-1]
+    return samp_name, r1, r2
 
-        samp_name = ent.__getitem__('name')
 
+def query_pages(fastq_query, page_size):
+    # Splits the results of Entity.get_by_query_params into lists of
+    # page_size entities, so rows are written (and their WorkFile names
+    # looked up) a page at a time. It doesn't limit what the query fetches:
+    # opyrnd gets its results however it does, possibly all at once, and
+    # page_size only sets how many of them are handled together.
+    entities = iter(Entity.get_by_query_params(fastq_query))
+    while True:
+        page = list(itertools.islice(entities, page_size))
+        if not page:
+            return
+        yield page
 
-        # need to update this logic when updating the data model
-        # oh boy - this better just be temp!
-        if "/" in samp_name:
-            samp_name = samp_name.split("/")[-1]
-        if len(wf_array) > 1:
-            r2 = wf_array[1]
-            wf_2_name = WorkFile.get_by_system_id(r2).originalName
 
+def copy_fastqs(api_base_url, api_token_secret, api_verify_https,
+                fastq_query, temp_workfile_dir, lookup_workers=16,
+                page_size=500, connect_timeout=10, read_timeout=300):
+    cfg = {'api_base_url': api_base_url,
+           "api_token_secret": api_token_secret,
+           'verify_https': api_verify_https}
 
-        tsv_file.write(f"{samp_name}\t{r1}\t{r2}\t{wf_1_name}\t{wf_2_name}\n")
+    ApiBacked.configure_from_dict(cfg)
+    # Connections for the lookup pool and this thread.
+    operend_session.install_session(lookup_workers + 1, connect_timeout, read_timeout)
+    names = WorkFileNames(lookup_workers)
+    try:
+        with open(f"{temp_workfile_dir}/this_tsv_file.tsv", "w") as tsv_file:
+            tsv_file.write('SAMPLE_ID\tR1_ID\tR2_ID\tR1_NAME\tR2_NAME\n')
+            for page in query_pages(fastq_query, page_size):
+                rows = [fastq_row(ent) for ent in page]
+                page_names = names.resolve(
+                    [r for _, r1, r2 in rows for r in (r1, r2) if r])
+                lines = []
+                for samp_name, r1, r2 in rows:
+                    wf_2_name = page_names[r2] if r2 else ""
+                    lines.append(f"{samp_name}\t{r1}\t{r2}\t{page_names[r1]}\t{wf_2_name}\n")
+                tsv_file.writelines(lines)
+                tsv_file.flush()
+    finally:
+        names.close()
 
 
 if __name__ == "__main__":
@@ -52,7 +105,16 @@ if __name__ == "__main__":
                         help="The base URL of the Operend Server")
     parser.add_argument('temp_workfile_dir', type=str,
                         help="The base URL of the Operend Server")
+    parser.add_argument('--lookup-workers', type=int, default=16,
+                        help="Look up the names of up to this many WorkFiles at once (default 16)")
+    parser.add_argument('--page-size', type=int, default=500,
+                        help="Look up WorkFile names and write rows for this many query results at a time (default 500). This doesn't change how the query itself is fetched")
+    parser.add_argument('--connect-timeout', type=float, default=10,
+                        help="Give up connecting to the Operend server after this many seconds (default 10)")
+    parser.add_argument('--read-timeout', type=float, default=300,
+                        help="Give up waiting for a response from the Operend server after this many seconds (default 300)")
     args = parser.parse_args()
     print(args)
     copy_fastqs(args.api_base_url, args.api_token_secret, args.api_verify_https, args.fastq_query,
-                args.temp_workfile_dir)
+                args.temp_workfile_dir, args.lookup_workers, args.page_size,
+                args.connect_timeout, args.read_timeout)
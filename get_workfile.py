@@ -1,23 +1,101 @@
 #!/usr/bin/python3
+import operend_session
 from opyrnd.api_backed import ApiBacked
 from opyrnd.entities import Entity
 from opyrnd.workfile import WorkFile
 import argparse
+import concurrent.futures
+import os
+import shutil
+import uuid
 
+# Bytes read from the server and written to disk at a time; memory use
+# per download is this, whatever the size of the WorkFile.
+CHUNK_SIZE = 1 << 20
 
-def copy_workfile(api_base_url, api_token_secret, api_verify_https,
-                  workfile_id, temp_workfile_dir):
+
+def configure(api_base_url, api_token_secret, api_verify_https,
+              pool_size=1, connect_timeout=10, read_timeout=300):
     cfg = {'api_base_url': api_base_url,
            "api_token_secret": api_token_secret,
            'verify_https': api_verify_https}
 
     ApiBacked.configure_from_dict(cfg)
-    wf = WorkFile.get_by_system_id(workfile_id)
-    new_file = open(f"{temp_workfile_dir}/{wf.originalName}", "wb")
-    new_file.write(wf.open().read())
+    operend_session.install_session(pool_size, connect_timeout, read_timeout)
+
+
+def download_workfile(wf, temp_workfile_dir, chunk_size=CHUNK_SIZE):
+    # Streams into a hidden file next to the destination and renames it
+    # into place once complete, so a failed or interrupted download never
+    # leaves a truncated file under the real name for Cromwell to pick up.
+    final_name = os.path.join(temp_workfile_dir, wf.originalName)
+    part_name = os.path.join(temp_workfile_dir,
+                             f".{wf.originalName}.{uuid.uuid4().hex}.part")
+    try:
+        with open(part_name, "xb") as new_file:
+            source = wf.open()
+            try:
+                shutil.copyfileobj(source, new_file, chunk_size)
+            finally:
+                if hasattr(source, "close"):
+                    source.close()
+        os.replace(part_name, final_name)
+    except BaseException:
+        if os.path.exists(part_name):
+            os.remove(part_name)
+        raise
     return wf.originalName
 
 
+def copy_workfile(api_base_url, api_token_secret, api_verify_https,
+                  workfile_id, temp_workfile_dir, chunk_size=CHUNK_SIZE,
+                  connect_timeout=10, read_timeout=300):
+    configure(api_base_url, api_token_secret, api_verify_https, 1,
+              connect_timeout, read_timeout)
+    wf = WorkFile.get_by_system_id(workfile_id)
+    return download_workfile(wf, temp_workfile_dir, chunk_size)
+
+
+def copy_workfiles(api_base_url, api_token_secret, api_verify_https,
+                   workfile_ids, temp_workfile_dir, workers=4,
+                   chunk_size=CHUNK_SIZE, connect_timeout=10, read_timeout=300):
+    # Stages many WorkFiles at once, up to workers downloads at a time;
+    # returns their originalNames in the order of workfile_ids. Every
+    # lookup and download is attempted even if some fail (an unknown id
+    # doesn't stop the others), and then the failures are raised together.
+    configure(api_base_url, api_token_secret, api_verify_https, workers,
+              connect_timeout, read_timeout)
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        lookups = [pool.submit(WorkFile.get_by_system_id, workfile_id)
+                   for workfile_id in workfile_ids]
+        workfiles = {}
+        names = {}
+        for workfile_id, lookup in zip(workfile_ids, lookups):
+            try:
+                wf = lookup.result()
+            except Exception as e:
+                failures.append(f"{workfile_id}: {e}")
+                continue
+            if wf.originalName in names:
+                failures.append(f"{workfile_id}: WorkFile {names[wf.originalName]} is also named {wf.originalName}; they can't be staged into the same directory")
+                continue
+            names[wf.originalName] = workfile_id
+            workfiles[workfile_id] = wf
+        futures = {workfile_id: pool.submit(download_workfile, wf,
+                                            temp_workfile_dir, chunk_size)
+                   for workfile_id, wf in workfiles.items()}
+        for workfile_id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(f"{workfile_id}: {e}")
+    if failures:
+        raise Exception(f"{len(failures)} of {len(workfile_ids)} WorkFiles failed to stage:\n"
+                        + "\n".join(failures))
+    return [workfiles[workfile_id].originalName for workfile_id in workfile_ids]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('api_base_url', type=str,
@@ -26,11 +104,24 @@ if __name__ == "__main__":
                         help="The token secert")
     parser.add_argument('api_verify_https', type=str,
                         help="The base URL of the Operend Server")
-    parser.add_argument('workfile_id', type=str,
-                        help="The base URL of the Operend Server")
+    parser.add_argument('workfile_id', type=str, nargs='+',
+                        help="The system ids of the WorkFiles to download")
     parser.add_argument('temp_workfile_dir', type=str,
                         help="The base URL of the Operend Server")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="With several workfile ids, download up to this many at once (default 4)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f"Bytes to read and write at a time (default {CHUNK_SIZE})")
+    parser.add_argument('--connect-timeout', type=float, default=10,
+                        help="Give up connecting to the Operend server after this many seconds (default 10)")
+    parser.add_argument('--read-timeout', type=float, default=300,
+                        help="Give up waiting for the Operend server after this many seconds without data (default 300)")
     args = parser.parse_args()
     print(args)
-    copy_workfile(args.api_base_url, args.api_token_secret, args.api_verify_https, args.workfile_id,
-                  args.temp_workfile_dir)
\ No newline at end of file
+    if len(args.workfile_id) == 1:
+        copy_workfile(args.api_base_url, args.api_token_secret, args.api_verify_https, args.workfile_id[0],
+                      args.temp_workfile_dir, args.chunk_size, args.connect_timeout, args.read_timeout)
+    else:
+        copy_workfiles(args.api_base_url, args.api_token_secret, args.api_verify_https, args.workfile_id,
+                       args.temp_workfile_dir, args.workers, args.chunk_size, args.connect_timeout,
+                       args.read_timeout)
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# One pooled, keep-alive HTTP session per process for everything opyrnd
+# sends to the Operend server, shared by cromwell2operend, fastq_copy and
+# get_workfile.
+#
+# opyrnd has no setting for the session it uses; it makes its calls
+# through the requests package's module-level functions (requests.get,
+# requests.post, ...), each of which opens, and closes, a connection of
+# its own: a TCP and TLS handshake per call. Importing this module points
+# those functions at whatever session install_session() last set up (and
+# leaves them behaving as before until then), so connections and their
+# TLS sessions are kept open and reused between calls. Import it before
+# opyrnd, so that this works even for functions opyrnd imports by name.
+# If opyrnd is ever changed to use a session of its own, this stops
+# having an effect but does no harm.
+#
+# The same place retries calls the server turns away (429, 503 and the
+# like) or that fail to connect, with exponential backoff and jitter, and
+# limits how many calls are in flight at once with an AIMD limiter (see
+# ConcurrencyLimiter), so that however many worker threads a script
+# runs, the server only sees as many concurrent calls as it is keeping up
+# with. Like the session, both only take effect once install_session()
+# has been called.
+import email.utils
+import random
+import threading
+import time
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+installed_session = None
+default_timeout = None
+retry_policies = {}
+limiter = None
+on_retry = None
+lock = threading.Lock()
+
+
+class RetryPolicy:
+    # When a call of one type is retried: up to max_retries times, on the
+    # HTTP statuses in retry_statuses, and on connection errors and
+    # timeouts if retry_sent is True, or else only on ones where the
+    # request can't have reached the server. The wait before retry n
+    # (counting from 0) is a random time up to
+    # min(max_delay, base_delay*2**n), or what the server's Retry-After
+    # asks for if that is longer (up to max_retry_after).
+    def __init__(self, max_retries=5, retry_statuses=(429, 502, 503, 504),
+                 retry_sent=True, base_delay=0.5, max_delay=60,
+                 max_retry_after=300):
+        self.max_retries = max_retries
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_sent = retry_sent
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, retry, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay,
+                                      self.base_delay * 2 ** retry))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+def default_policies(max_retries=5, max_delay=60):
+    # Reads, and the idempotent PUT and DELETE, can always be sent again.
+    # Writes are only sent again when they can't have taken effect: the
+    # connection was never made, or the server itself turned them away.
+    # For Entity and JobRun saves that is 429 or 503 only; a 502 can come
+    # from a proxy after the server got the request, and a second save
+    # could create a duplicate Entity. File uploads are also retried on
+    # 500 and 502, where a duplicate would just be an unreferenced
+    # WorkFile, but not after a timeout or a 504 once the body is sent:
+    # that can mean sending a many-gigabyte file twice, and a rerun with
+    # --resume only uploads what the journal doesn't already have.
+    return {
+        "read": RetryPolicy(max_retries, (429, 500, 502, 503, 504), True,
+                            max_delay=max_delay),
+        "upload": RetryPolicy(max_retries, (429, 500, 502, 503), False,
+                              max_delay=max_delay),
+        "write": RetryPolicy(max_retries, (429, 503), False,
+                             max_delay=max_delay),
+    }
+
+
+def call_type(method, kwargs):
+    if method in ("GET", "HEAD", "OPTIONS", "PUT", "DELETE"):
+        return "read"
+    data = kwargs.get("data")
+    if kwargs.get("files") or hasattr(data, "read"):
+        return "upload"
+    return "write"
+
+
+class ConcurrencyLimiter:
+    # Additive-increase, multiplicative-decrease limit on the calls in
+    # flight, as TCP does for packets: each call that succeeds raises the
+    # limit by 1/limit (so by about 1 per limit's worth of calls), and a
+    # call the server pushes back on (429, 503, a timeout) halves it, down
+    # to min_limit. Calls that started before the last halving don't halve
+    # it again, so one burst of rejections counts once. The limit never
+    # goes above max_limit, which should be the number of threads that
+    # might make calls; threads beyond the limit wait in acquire().
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, overloaded):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                if started >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = time.monotonic()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+def install_session(pool_size=10, connect_timeout=10, read_timeout=300,
+                    max_retries=5, retry_max_delay=60, adaptive=True,
+                    retry_callback=None):
+    # pool_size should be at least the number of threads that talk to
+    # the server at once; threads beyond it wait for a free connection
+    # rather than opening a throwaway one. It is also where the
+    # concurrency limiter starts, and its ceiling; adaptive=False turns the
+    # limiter off. The timeouts apply to calls that don't give their own.
+    # retry_callback(call_type) is called before each retry. Returns the
+    # session, or None if requests isn't installed. Calling it again
+    # replaces the session.
+    global installed_session, default_timeout, retry_policies, limiter, on_retry
+    if requests is None:
+        return None
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size),
+                          pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    with lock:
+        old_session = installed_session
+        installed_session = session
+        default_timeout = (connect_timeout, read_timeout)
+        retry_policies = default_policies(max_retries, retry_max_delay)
+        limiter = ConcurrencyLimiter(pool_size) if adaptive else None
+        on_retry = retry_callback
+    if old_session:
+        old_session.close()
+    return session
+
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def never_sent(error):
+    # Whether a requests exception means the request can't have reached
+    # the server: it timed out or was refused while connecting.
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, requests.packages.urllib3.exceptions.NewConnectionError)
+
+
+def rewinder(kwargs):
+    # A function that puts file bodies back where they started, so the
+    # request can be sent again, or None if a body can't be rewound.
+    bodies = [kwargs.get("data")]
+    files = kwargs.get("files")
+    if files:
+        for value in (files.values() if isinstance(files, dict) else
+                      (v for _, v in files)):
+            bodies.append(value[1] if isinstance(value, (tuple, list)) else value)
+    positions = []
+    for body in bodies:
+        if hasattr(body, "read"):
+            try:
+                positions.append((body, body.tell()))
+            except (AttributeError, OSError):
+                return None
+        elif body is not None and not isinstance(body, (str, bytes, dict, list, tuple)):
+            return None
+
+    def rewind():
+        for body, position in positions:
+            body.seek(position)
+    return rewind
+
+
+def request(method, url, **kwargs):
+    session = installed_session
+    if session is None:
+        return original_request(method, url, **kwargs)
+    kwargs.setdefault("timeout", default_timeout)
+    method = method.upper()
+    kind = call_type(method, kwargs)
+    policy = retry_policies[kind]
+    rewind = rewinder(kwargs)
+    retry = 0
+    while True:
+        started = limiter.acquire() if limiter else None
+        response = error = None
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        finally:
+            if limiter:
+                limiter.release(started, error is not None or (
+                    response is not None and response.status_code in (429, 503)))
+        if response is not None:
+            if response.status_code not in policy.retry_statuses:
+                return response
+            reason = f"HTTP {response.status_code}"
+            retry_after = retry_after_seconds(response)
+        else:
+            if not (policy.retry_sent or never_sent(error)):
+                raise error
+            reason = type(error).__name__
+            retry_after = None
+        if retry >= policy.max_retries or rewind is None:
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            response.close()
+        delay = policy.backoff(retry, retry_after)
+        print(f"{method} {url} failed ({reason}); retrying in {delay:.1f}s "
+              f"({retry+1} of {policy.max_retries})")
+        if on_retry:
+            on_retry(kind)
+        time.sleep(delay)
+        rewind()
+        retry += 1
+
+
+def get(url, params=None, **kwargs):
+    return request("GET", url, params=params, **kwargs)
+
+
+def options(url, **kwargs):
+    return request("OPTIONS", url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault("allow_redirects", False)
+    return request("HEAD", url, **kwargs)
+
+
+def post(url, data=None, json=None, **kwargs):
+    return request("POST", url, data=data, json=json, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request("PUT", url, data=data, **kwargs)
+
+
+def patch(url, data=None, **kwargs):
+    return request("PATCH", url, data=data, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+if requests is not None and getattr(requests.request, "__module__", None) != __name__:
+    original_request = requests.request
+    for name, function in (("request", request), ("get", get),
+                           ("options", options), ("head", head),
+                           ("post", post), ("put", put),
+                           ("patch", patch), ("delete", delete)):
+        setattr(requests, name, function)
+        setattr(requests.api, name, function)
@@ -0,0 +1,65 @@
+# Measures what operend_session saves per request, against a local HTTP
+# server standing in for Operend; not part of deployment. It times the
+# same small POSTs sent through requests.post the way opyrnd sends them,
+# first with a new connection per call and then through the pooled
+# session, from --threads threads at once.
+import sys
+import os
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import operend_session
+import requests
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Sends headers and body as they are written, as real servers do,
+    # rather than waiting on the client's delayed ACK between them.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"systemId": 1}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_requests(url, count, threads):
+    def send(_):
+        requests.post(url, json={"name": "x"}).raise_for_status()
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(send, range(count)))
+    return (time.perf_counter() - start) / count
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Compare per-request time with and without the pooled session.")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per measurement (default 2000).")
+    parser.add_argument('--threads', type=int, default=8, help="threads sending at once (default 8).")
+    parsed_args = parser.parse_args(argv[1:])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/workfiles"
+    unpooled = time_requests(url, parsed_args.requests, parsed_args.threads)
+    operend_session.install_session(parsed_args.threads)
+    pooled = time_requests(url, parsed_args.requests, parsed_args.threads)
+    print(f"connection per request: {unpooled*1000:.3f} ms/request")
+    print(f"pooled session:         {pooled*1000:.3f} ms/request ({1-pooled/unpooled:.0%} less)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,152 @@
+# Times and memory-profiles the local phases of cromwell2operend on
+# synthetic metadata (see make_synthetic_metadata.py) so that changes to
+# CromwellIO and IOMapping can be checked for regressions; not part of
+# deployment. Nothing here talks to an Operend server, but opyrnd still has
+# to be importable, since cromwell2operend imports it.
+#
+# Typical use: run it before and after a change, and compare:
+#   python test_helpers/benchmark.py --out before.json
+#   python test_helpers/benchmark.py --out after.json --compare before.json
+import sys
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+
+here=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import cromwell2operend
+from make_synthetic_metadata import make_synthetic
+
+PHASES=["load", "stream", "list_metadata", "dry_validate", "dry_run_posts"]
+
+def phase_functions(metadata_filename, manifest_data, mock_filename):
+    """Returns {phase name: function of no arguments} for one metadata file.
+    The table that dry_validate and dry_run_posts work on is made up front,
+    so that they only measure themselves."""
+    table=cromwell2operend.load_cromwell_io(metadata_filename);
+    def load():
+        return cromwell2operend.load_cromwell_io(metadata_filename)
+    def stream():
+        return cromwell2operend.load_cromwell_io(metadata_filename, stream=True)
+    def list_metadata():
+        cromwell2operend.list_metadata(metadata_filename)
+    def dry_validate():
+        manifest=cromwell2operend.IOMapping(manifest_data, mock_filename)
+        manifest.dry_validate(table)
+    def dry_run_posts():
+        manifest=cromwell2operend.IOMapping(manifest_data, mock_filename)
+        cromwell2operend.dry_run_posts(table, manifest)
+    return {"load": load, "stream": stream, "list_metadata": list_metadata,
+            "dry_validate": dry_validate, "dry_run_posts": dry_run_posts}
+
+def measure(function, repeat, memory):
+    # Best-of-repeat wall time with output thrown away, since printing
+    # is part of what some phases do but the terminal's speed isn't; then,
+    # separately because tracemalloc slows everything down, peak memory.
+    best=None
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            gc.collect();
+            start=time.perf_counter();
+            function();
+            elapsed=time.perf_counter()-start
+            best=elapsed if best is None else min(best,elapsed)
+        peak=None
+        if memory:
+            gc.collect();
+            tracemalloc.start();
+            function();
+            peak=tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop();
+    return best, peak
+
+def git_commit():
+    try:
+        return subprocess.run(["git","rev-parse","--short","HEAD"], cwd=here,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, old_results, threshold):
+    """Prints each phase's change against an earlier run, and returns the
+    number of phases more than threshold (a fraction) slower."""
+    old={(r["shards"],r["phase"]): r for r in old_results["results"]}
+    regressions=0
+    for r in results["results"]:
+        before=old.get((r["shards"],r["phase"]))
+        if not before:
+            continue
+        change=r["seconds"]/before["seconds"]-1 if before["seconds"] else 0.0
+        line=f"{r['shards']:>8} {r['phase']:<14} {before['seconds']:9.3f}s -> {r['seconds']:9.3f}s {change:+7.1%}"
+        if r.get("peak_bytes") and before.get("peak_bytes"):
+            line+=f"   peak {cromwell2operend.format_bytes(before['peak_bytes'])} -> {cromwell2operend.format_bytes(r['peak_bytes'])}"
+        if change>threshold:
+            line+="   SLOWER"
+            regressions+=1
+        print(line)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark cromwell2operend's local phases on synthetic metadata.")
+    parser.add_argument('--sizes',default="1000,10000,100000",help="comma-separated shard counts (default 1000,10000,100000).");
+    parser.add_argument('--phases',default=",".join(PHASES),help=f"comma-separated phases to run (default {','.join(PHASES)}).");
+    parser.add_argument('--calls',type=int,default=3,help="task calls per shard (default 3).");
+    parser.add_argument('--depth',type=int,default=1,help="subworkflow nesting depth (default 1).");
+    parser.add_argument('--array-width',type=int,default=2,help="files per array output (default 2).");
+    parser.add_argument('--inputs',type=int,default=4,help="inputs per call (default 4).");
+    parser.add_argument('--outputs',type=int,default=2,help="file outputs per task call (default 2).");
+    parser.add_argument('--repeat',type=int,default=3,help="time each phase this many times and keep the best (default 3).");
+    parser.add_argument('--no-memory',action='store_true',help="skip the tracemalloc pass.");
+    parser.add_argument('--out',default="benchmark_results.json",help="where to write the results JSON (default benchmark_results.json).");
+    parser.add_argument('--compare',metavar='OLD_JSON',help="compare against an earlier results file; exits nonzero if any phase got slower by more than --threshold.");
+    parser.add_argument('--threshold',type=float,default=0.10,help="fractional slowdown that counts as a regression (default 0.10).");
+    parsed_args=parser.parse_args(argv[1:]);
+    phases=parsed_args.phases.split(",")
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error(f"unknown phase {phase}; choose from {','.join(PHASES)}");
+    shape={"calls": parsed_args.calls, "depth": parsed_args.depth,
+           "array_width": parsed_args.array_width,
+           "inputs": parsed_args.inputs, "outputs": parsed_args.outputs}
+    results={"commit": git_commit(), "python": platform.python_version(),
+             "platform": platform.platform(), "shape": shape,
+             "repeat": parsed_args.repeat, "results": []}
+    mock_filename=os.path.join(here,"small_file")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for shards in [int(s) for s in parsed_args.sizes.split(",")]:
+            metadata,manifest_data=make_synthetic(shards, **shape)
+            metadata_filename=os.path.join(work_dir,f"metadata_{shards}.json")
+            with open(metadata_filename,"w") as f:
+                json.dump(metadata,f);
+            del metadata
+            size=os.path.getsize(metadata_filename)
+            functions=phase_functions(metadata_filename, manifest_data, mock_filename)
+            for phase in phases:
+                seconds,peak=measure(functions[phase], parsed_args.repeat,
+                                     not parsed_args.no_memory)
+                results["results"].append({"shards": shards, "phase": phase,
+                                            "metadata_bytes": size,
+                                            "seconds": seconds,
+                                            "peak_bytes": peak})
+                memory=f", peak {cromwell2operend.format_bytes(peak)}" if peak is not None else ""
+                print(f"{shards:>8} shards ({cromwell2operend.format_bytes(size)}) {phase:<14} {seconds:9.3f}s{memory}", flush=True)
+            del functions
+            os.remove(metadata_filename)
+    with open(parsed_args.out,"w") as f:
+        json.dump(results,f,indent=1);
+    print(f"results written to {parsed_args.out}")
+    if parsed_args.compare:
+        with open(parsed_args.compare) as f:
+            old_results=json.load(f)
+        if compare(results, old_results, parsed_args.threshold):
+            return 1
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,80 @@
+# Checks that operend_session gets every request through a server that
+# throttles, fails and drops connections (stub_operend_server.py, run
+# in-process), and that its concurrency limiter settles near what the
+# server can take; not part of deployment. It sends --requests uploads
+# and entity-style JSON POSTs through requests.post, as opyrnd does, from
+# --threads threads, and exits non-zero if any of them failed, other than
+# ones whose connection was dropped after they were sent: those are
+# deliberately not retried, since the server may have saved them.
+import sys
+import os
+import io
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import operend_session
+import requests
+from stub_operend_server import add_fault_arguments, make_server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Send requests through operend_session to a faulty stub server.")
+    parser.add_argument('--requests', type=int, default=1000, help="requests to send (default 1000).")
+    parser.add_argument('--threads', type=int, default=32, help="threads sending at once (default 32).")
+    parser.add_argument('--max-retries', type=int, default=8, help="operend_session max_retries (default 8).")
+    parser.add_argument('--retry-max-delay', type=float, default=1, help="operend_session retry_max_delay (default 1).")
+    parser.add_argument('--no-adaptive-concurrency', action='store_true', help="turn the concurrency limiter off.")
+    add_fault_arguments(parser)
+    parsed_args = parser.parse_args(argv[1:])
+    server = make_server(parsed_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+    retries = {}
+    lock = threading.Lock()
+
+    def count_retry(call_type):
+        with lock:
+            retries[call_type] = retries.get(call_type, 0) + 1
+    operend_session.install_session(parsed_args.threads, 2, 10, parsed_args.max_retries,
+                                    parsed_args.retry_max_delay,
+                                    not parsed_args.no_adaptive_concurrency, count_retry)
+
+    def send(n):
+        if n % 2:
+            response = requests.post(url + "/workfiles", files={"file": ("f.txt", io.BytesIO(b"x" * 1000))})
+        else:
+            response = requests.post(url + "/entities", json={"n": n})
+        response.raise_for_status()
+
+    failures = []
+    unretried = 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parsed_args.threads) as pool:
+        for n, future in enumerate([pool.submit(send, n) for n in range(parsed_args.requests)]):
+            try:
+                future.result()
+            except requests.exceptions.ConnectionError as e:
+                if operend_session.never_sent(e):
+                    failures.append(f"request {n}: {type(e).__name__}: {e}")
+                else:
+                    unretried += 1
+            except Exception as e:
+                failures.append(f"request {n}: {type(e).__name__}: {e}")
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    limiter = operend_session.limiter
+    print(json.dumps({"seconds": round(elapsed, 2), "failed": len(failures),
+                      "dropped_not_retried": unretried, "retries": retries,
+                      "final_limit": round(limiter.limit, 1) if limiter else None,
+                      "server": server.stats}, indent=1))
+    for failure in failures[:10]:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
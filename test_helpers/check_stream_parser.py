@@ -0,0 +1,80 @@
+# Checks that cromwell2operend's --stream parsing (JSONEventReader and
+# CromwellIO.from_stream) comes out the same as json.load however the
+# file is cut into chunks, including numbers cut in the middle, as in
+# 0.5, 1e-3 or -2.5E+10; not part of deployment. opyrnd has to be
+# importable, since cromwell2operend imports it. Exits non-zero on any
+# difference.
+import sys
+import os
+import io
+import json
+import argparse
+
+here=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import cromwell2operend
+from cromwell2operend import CromwellIO, JSONEventReader
+from make_synthetic_metadata import make_synthetic
+
+NUMBERS=[0, -1, 0.5, 12.25, 1e-3, -2.5E+10, 6.02e23, 123456789, 1.0, -0.0]
+
+def numeric_metadata():
+    # Synthetic metadata whose every input and output is a number, or a
+    # list of them, with plain tasks at depth 0 so each value lands in a row.
+    metadata,_=make_synthetic(12, calls=2, depth=0, inputs=3, outputs=2)
+    n=0
+    for shards in metadata["calls"].values():
+        for shard in shards:
+            for values in (shard["inputs"], shard["outputs"]):
+                for key in values:
+                    values[key]=NUMBERS[n%len(NUMBERS)]
+                    n+=1
+            shard["outputs"]["several"]=NUMBERS[n%len(NUMBERS):]+NUMBERS
+    return metadata
+
+def rows(table):
+    return {repr(row): (dict(table.input_rows[row]), dict(table.output_rows[row]))
+            for row in table.row_numbers}
+
+def read_whole(text):
+    # Reads a whole document through JSONEventReader, walking containers
+    # with iter_object/iter_array and numbers with read_value.
+    reader=JSONEventReader(io.StringIO(text))
+    def value():
+        char=reader._peek()
+        if char=="{":
+            return {key: value() for key in reader.iter_object()}
+        if char=="[":
+            return [value() for _ in reader.iter_array()]
+        return reader.read_value()
+    return value()
+
+def main(argv):
+    parser=argparse.ArgumentParser(description="Compare --stream parsing against json.load at small chunk sizes.")
+    parser.add_argument('--chunk-sizes',default="1,2,7",help="comma-separated chunk sizes to try (default 1,2,7).")
+    parsed_args=parser.parse_args(argv[1:])
+    metadata=numeric_metadata()
+    text=json.dumps(metadata)
+    expected=rows(CromwellIO(json.loads(text)))
+    problems=[]
+    saved=JSONEventReader.chunk_size
+    try:
+        for size in [int(s) for s in parsed_args.chunk_sizes.split(",")]:
+            JSONEventReader.chunk_size=size
+            try:
+                if read_whole(text)!=json.loads(text):
+                    problems.append(f"chunk size {size}: JSONEventReader differs from json.load")
+                streamed=rows(CromwellIO.from_stream(io.BytesIO(text.encode())))
+                if streamed!=expected:
+                    problems.append(f"chunk size {size}: CromwellIO.from_stream differs from json.load")
+            except Exception as e:
+                problems.append(f"chunk size {size}: {type(e).__name__}: {e}")
+    finally:
+        JSONEventReader.chunk_size=saved
+    for problem in problems:
+        print(problem)
+    print("ok" if not problems else f"{len(problems)} problems")
+    return 1 if problems else 0
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv))
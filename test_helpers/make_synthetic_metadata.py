@@ -0,0 +1,110 @@
+# Makes synthetic Cromwell metadata, and a manifest to go with it, for
+# benchmarking cromwell2operend at sizes nobody would want to make by hand;
+# not part of deployment.
+#
+# The metadata has a top-level workflow "synthetic" with one row per shard.
+# With --depth 0, each of the --calls task calls is scattered directly, so
+# the names are task_<k>.in_<j> and task_<k>.out_<j>. With --depth D > 0,
+# a scattered call "per_sample" runs subworkflow level_1, which runs
+# level_2 and so on down to level_D, where the task calls are; the names
+# are then level_D.task_<k>.out_<j>, plus per_sample.in_<j> for the
+# per-row inputs. --array-width A > 0 adds array outputs of A files each:
+# with --depth 0, task_0.parts is a list-valued output, and deeper, a call
+# "scatter" in level_D is itself scattered A ways, so its
+# level_D.scatter.part outputs come out as arrays on the row.
+#
+# The manifest maps the first input of every task call, and every file
+# output, to entity variables named after them with the dots turned into
+# underscores, in entity class syntheticBenchmark.
+import sys
+import os
+import json
+import argparse
+
+def task_call(shard_index, shard, k, inputs, outputs):
+    return {
+        "shardIndex": shard_index,
+        "executionStatus": "Done",
+        "attempt": 1,
+        "inputs": {f"in_{j}": f"sample_{shard}_value_{j}" if j%2==0 else shard*inputs+j
+                   for j in range(inputs)},
+        "outputs": {f"out_{j}": f"/synthetic/shard_{shard}/task_{k}/out_{j}.txt"
+                    for j in range(outputs)},
+    }
+
+def make_synthetic(shards, calls=3, depth=1, array_width=0, inputs=4, outputs=2):
+    """Returns (metadata, manifest) dicts for the given shape."""
+    def tasks(shard, level_name):
+        prefix=f"{level_name}." if level_name else "synthetic."
+        result={}
+        for k in range(calls):
+            call=task_call(-1, shard, k, inputs, outputs)
+            if not level_name and k==0 and array_width:
+                call["outputs"]["parts"]=[f"/synthetic/shard_{shard}/task_0/part_{a}.txt"
+                                          for a in range(array_width)]
+            result[f"{prefix}task_{k}"]=[call]
+        if level_name and array_width:
+            result[f"{prefix}scatter"]=[
+                {"shardIndex": a, "executionStatus": "Done", "attempt": 1,
+                 "inputs": {"part_number": a},
+                 "outputs": {"part": f"/synthetic/shard_{shard}/scatter/part_{a}.txt"}}
+                for a in range(array_width)]
+        return result
+    def level(shard, d):
+        name=f"level_{d}"
+        level_calls=tasks(shard, name) if d==depth else {
+            f"{name}.nested": [{"shardIndex": -1, "executionStatus": "Done",
+                                "attempt": 1, "inputs": {},
+                                "subWorkflowMetadata": level(shard, d+1)}]}
+        return {"workflowName": name, "status": "Succeeded", "calls": level_calls}
+
+    if depth==0:
+        top_calls={}
+        for shard in range(shards):
+            for key,(call,) in tasks(shard, None).items():
+                call["shardIndex"]=shard
+                top_calls.setdefault(key,[]).append(call)
+        names=[f"task_{k}" for k in range(calls)]
+    else:
+        top_calls={"synthetic.per_sample": [
+            {"subWorkflowMetadata": level(shard, 1),
+             "shardIndex": shard, "executionStatus": "Done", "attempt": 1,
+             "inputs": {f"in_{j}": f"sample_{shard}_{j}" for j in range(inputs)}}
+            for shard in range(shards)]}
+        names=[f"level_{depth}.task_{k}" for k in range(calls)]
+    metadata={"workflowName": "synthetic", "status": "Succeeded",
+              "id": "00000000-0000-0000-0000-000000000000",
+              "calls": top_calls, "outputs": {}, "inputs": {}}
+
+    input_values={f"{name}.in_0": f"{name}.in_0".replace(".","_") for name in names}
+    output_files={f"{name}.out_{j}": f"{name}.out_{j}".replace(".","_")
+                  for name in names for j in range(outputs)}
+    if array_width:
+        parts="task_0.parts" if depth==0 else f"level_{depth}.scatter.part"
+        output_files[parts]=parts.replace(".","_")
+    manifest={"entityClass": "syntheticBenchmark",
+              "inputValues": input_values,
+              "outputFiles": output_files}
+    return metadata, manifest
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Write synthetic Cromwell metadata and a matching manifest.")
+    parser.add_argument('OUT_DIR', help="directory to write metadata.json and manifest.json into.");
+    parser.add_argument('--shards',type=int,default=1000,help="number of rows (default 1000).");
+    parser.add_argument('--calls',type=int,default=3,help="task calls per shard (default 3).");
+    parser.add_argument('--depth',type=int,default=1,help="subworkflow nesting depth (default 1; 0 scatters the tasks directly).");
+    parser.add_argument('--array-width',type=int,default=0,help="files per array output; 0 (the default) for no array outputs.");
+    parser.add_argument('--inputs',type=int,default=4,help="inputs per call (default 4).");
+    parser.add_argument('--outputs',type=int,default=2,help="file outputs per task call (default 2).");
+    parsed_args=parser.parse_args(argv[1:]);
+    metadata,manifest=make_synthetic(parsed_args.shards, parsed_args.calls,
+                                     parsed_args.depth, parsed_args.array_width,
+                                     parsed_args.inputs, parsed_args.outputs)
+    os.makedirs(parsed_args.OUT_DIR, exist_ok=True)
+    with open(os.path.join(parsed_args.OUT_DIR,"metadata.json"),"w") as f:
+        json.dump(metadata,f);
+    with open(os.path.join(parsed_args.OUT_DIR,"manifest.json"),"w") as f:
+        json.dump(manifest,f,indent=1);
+
+if __name__=="__main__":
+    main(sys.argv)
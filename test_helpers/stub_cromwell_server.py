@@ -0,0 +1,96 @@
+# A stand-in for a Cromwell server running a workflow, for trying out
+# cromwell2operend --watch without a real workflow; not part of deployment.
+#
+# It serves GET /api/workflows/v1/<any id>/metadata from a finished
+# metadata file, pretending the workflow is partway through: at first
+# every row's shards (see cromwell2operend.row_defining_shards) are
+# Running, with no outputs, and each request for the metadata lets
+# --rows-per-poll more rows finish, as Done. Once all of them have, the
+# workflow's status is Succeeded. For example:
+#   python test_helpers/stub_cromwell_server.py test_helpers/meta_big_job.json &
+#   python cromwell2operend.py --watch --watch-interval 1 --very-dry-run \
+#       --mock-file test_helpers/small_file \
+#       http://localhost:8000/api/workflows/v1/test test_helpers/manifest_big_job.json
+import sys
+import os
+import json
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cromwell2operend import row_defining_shards
+
+
+def running_copy(shard):
+    running = {k: v for k, v in shard.items()
+               if k not in ("outputs", "subWorkflowMetadata", "end")}
+    running["executionStatus"] = "Running"
+    return running
+
+
+def metadata_at(metadata, finished_rows):
+    # The metadata as it would look with just finished_rows done. Shards
+    # are swapped by identity, so the rest of the document is shared.
+    swaps = {}
+    for row, shards in row_defining_shards(metadata).items():
+        for shard in shards:
+            if row in finished_rows:
+                swaps[id(shard)] = dict(shard, executionStatus="Done")
+            else:
+                swaps[id(shard)] = running_copy(shard)
+    calls = {}
+    stack = [(metadata["calls"], calls)]
+    while stack:
+        source, copy = stack.pop()
+        for key, shards in source.items():
+            copy[key] = []
+            for shard in shards:
+                if id(shard) in swaps:
+                    copy[key].append(swaps[id(shard)])
+                elif "subWorkflowMetadata" in shard:
+                    sub_calls = {}
+                    copy[key].append(dict(shard, subWorkflowMetadata=dict(
+                        shard["subWorkflowMetadata"], calls=sub_calls)))
+                    stack.append((shard["subWorkflowMetadata"]["calls"], sub_calls))
+                else:
+                    copy[key].append(shard)
+    done = len(finished_rows) == len(row_defining_shards(metadata))
+    return dict(metadata, calls=calls, status="Succeeded" if done else "Running")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve a finished Cromwell metadata file as if its workflow were still running.")
+    parser.add_argument('METADATA', help="finished Cromwell metadata JSON to serve.")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on (default 8000).")
+    parser.add_argument('--rows-per-poll', type=int, default=1, help="rows that finish with each metadata request (default 1).")
+    parsed_args = parser.parse_args(argv[1:])
+    with open(parsed_args.METADATA) as f:
+        metadata = json.load(f)
+    rows = sorted(row_defining_shards(metadata))
+    state = {"finished": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if not (path.startswith("/api/workflows/v1/") and path.endswith("/metadata")):
+                self.send_error(404)
+                return
+            with lock:
+                finished = set(rows[:state["finished"]])
+                state["finished"] = min(len(rows), state["finished"] + parsed_args.rows_per_poll)
+            body = json.dumps(metadata_at(metadata, finished)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(("", parsed_args.port), Handler)
+    print(f"serving {parsed_args.METADATA} on port {parsed_args.port}, {len(rows)} rows")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
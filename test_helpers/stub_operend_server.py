@@ -0,0 +1,134 @@
+# A stand-in for an Operend server that misbehaves on purpose, for trying
+# out the retries and the concurrency limiter in operend_session.py; not
+# part of deployment. It answers every request, whatever the path, with
+# {"systemId": N}, except that:
+#   - while more than --capacity requests are being handled, further ones
+#     get 429 with a Retry-After of --retry-after seconds (if given),
+#   - a --error-rate fraction of the rest get 503 (or 500 for GETs),
+#   - a --drop-rate fraction have their connection closed with no answer,
+# and every answer takes --latency seconds. check_retries.py runs one of
+# these in-process and sends it requests the way opyrnd does.
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FaultyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, capacity=8, error_rate=0.0, drop_rate=0.0,
+                 latency=0.01, retry_after=None, seed=None):
+        super().__init__(address, FaultyHandler)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.latency = latency
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0,
+                      "dropped": 0, "peak_in_flight": 0}
+
+    def fault(self):
+        # What to do with a request that has just arrived: "throttle",
+        # "error", "drop" or "ok". Counts it as in flight unless throttled.
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.in_flight >= self.capacity:
+                self.stats["throttled"] += 1
+                return "throttle"
+            self.in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+            roll = self.random.random()
+            if roll < self.drop_rate:
+                self.stats["dropped"] += 1
+                return "drop"
+            if roll < self.drop_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+            self.stats["ok"] += 1
+            return "ok"
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+class FaultyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def handle_any(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        outcome = server.fault()
+        if outcome == "throttle":
+            headers = {"Retry-After": str(server.retry_after)} if server.retry_after is not None else {}
+            self.reply(429, {"error": "too many requests"}, headers)
+            return
+        try:
+            time.sleep(server.latency)
+            if outcome == "drop":
+                self.close_connection = True
+                self.connection.shutdown(2)
+            elif outcome == "error":
+                self.reply(500 if self.command == "GET" else 503, {"error": "injected fault"})
+            else:
+                with server.lock:
+                    system_id = server.stats["ok"]
+                self.reply(200, {"systemId": system_id})
+        finally:
+            server.done()
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_any
+
+    def reply(self, status, payload, headers={}):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--capacity', type=int, default=8, help="requests handled at once before answering 429 (default 8).")
+    parser.add_argument('--error-rate', type=float, default=0.05, help="fraction of requests answered 503/500 (default 0.05).")
+    parser.add_argument('--drop-rate', type=float, default=0.01, help="fraction of requests whose connection is dropped (default 0.01).")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds each answer takes (default 0.01).")
+    parser.add_argument('--retry-after', type=float, help="Retry-After seconds to send with 429s (default: none).")
+    parser.add_argument('--seed', type=int, help="random seed, for repeatable faults.")
+
+
+def make_server(parsed_args, port=0):
+    return FaultyServer(("127.0.0.1", port), parsed_args.capacity, parsed_args.error_rate,
+                        parsed_args.drop_rate, parsed_args.latency, parsed_args.retry_after,
+                        parsed_args.seed)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve fake Operend answers with injected faults.")
+    parser.add_argument('--port', type=int, default=8001, help="port to listen on (default 8001).")
+    add_fault_arguments(parser)
+    parsed_args = parser.parse_args(argv[1:])
+    server = make_server(parsed_args, parsed_args.port)
+    print(f"serving on port {parsed_args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main(sys.argv)